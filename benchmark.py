@@ -0,0 +1,205 @@
+# Engine benchmark over fixed positions taken from the gameTrace files.
+#
+#   python benchmark.py -o bench.json                 run and save results
+#   python benchmark.py -o new.json --compare bench.json
+#                                                     run and flag regressions
+#   python benchmark.py --compare bench.json new.json  compare saved results
+#
+# Every board drawn in a trace (minus finished games and duplicates) is a
+# position. Each one is searched with every algorithm at fixed depths
+# without a time limit, recording nodes, nodes/sec, time, heuristic
+# evaluations by depth and the peak memory allocated by the search.
+
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+
+from bitboard import from_rows
+from engine import Engine
+from gametrace import read_trace
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ALGOS = {
+    Engine.MINIMAX: 'minimax',
+    Engine.ALPHABETA: 'alphabeta',
+    Engine.NEGAMAX: 'negamax',
+}
+
+
+def corpus(paths):
+  positions = []
+  seen = set()
+  for path in paths:
+    trace = read_trace(path)
+    n = trace['n']
+    s = trace['s']
+    for ply, rows in enumerate(trace['boards']):
+      key = (n, s, tuple(rows))
+      cells = ''.join(rows)
+      if key in seen or '.' not in cells:
+        continue
+      seen.add(key)
+      positions.append({
+          'id': f'{os.path.basename(path)}:{ply}',
+          'n': n,
+          's': s,
+          'blocks': trace['blocks'],
+          'rows': rows,
+      })
+  return positions
+
+
+def setup(position, depth, options):
+  board = from_rows(position['rows'], position['s'])
+  if board.result() is not None:
+    return None
+  g = Engine(n=position['n'],
+             s=position['s'],
+             blocks=position['blocks'],
+             depth1=depth,
+             depth2=depth,
+             t=None,
+             **options)
+  g.load(board)
+  return g
+
+
+def measure(position, algo, depth, options, memory=True):
+  g = setup(position, depth, options)
+  if g is None:
+    return None
+  maximize = g.player_turn == 'O'
+  start = time.perf_counter()
+  (value, x, y) = g.search(algo, max=maximize, d=depth, start=time.time(),
+                           limit=float('inf'))
+  seconds = time.perf_counter() - start
+  g.close()
+  result = {
+      'id': position['id'],
+      'algo': ALGOS[algo],
+      'depth': depth,
+      'move': [x, y],
+      'nodes': g.nodes,
+      'evals': g.invocations,
+      'depth_evals': dict(g.depth_evals),
+      'seconds': seconds,
+      'nps': g.nodes / seconds if seconds else 0.0,
+  }
+  if memory:
+    # Separate untimed run, tracemalloc slows the search down several times
+    g = setup(position, depth, options)
+    tracemalloc.start()
+    g.search(algo, max=maximize, d=depth, start=time.time(), limit=float('inf'))
+    result['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    g.close()
+  return result
+
+
+def run(paths, depths, options, memory=True, log=sys.stderr):
+  results = []
+  for position in corpus(paths):
+    for algo in ALGOS:
+      for depth in depths:
+        result = measure(position, algo, depth, options, memory)
+        if result is None:
+          continue
+        results.append(result)
+        log.write(f'{result["id"]:<22} {result["algo"]:<9} d={depth} '
+                  f'nodes={result["nodes"]:<8} {result["nps"]:>10.0f} nodes/s '
+                  f'{result["seconds"]:.3f}s\n')
+  summary = {}
+  for result in results:
+    total = summary.setdefault(result['algo'], {
+        'positions': 0,
+        'nodes': 0,
+        'evals': 0,
+        'seconds': 0.0
+    })
+    total['positions'] += 1
+    total['nodes'] += result['nodes']
+    total['evals'] += result['evals']
+    total['seconds'] += result['seconds']
+  for total in summary.values():
+    total['nps'] = total['nodes'] / total['seconds'] if total['seconds'] else 0
+    total['seconds_per_move'] = total['seconds'] / total['positions']
+  return {
+      'python': platform.python_implementation() + ' ' +
+                platform.python_version(),
+      'depths': depths,
+      'options': options,
+      'results': results,
+      'summary': summary,
+  }
+
+
+def compare(baseline, current, tolerance=0.1, floor=0.005, out=sys.stdout):
+  # A position is a regression when it got more than tolerance slower (and
+  # by more than floor seconds, below which timings are mostly noise). A
+  # changed node count or move is reported too, since it means the search
+  # itself changed and the timings are not like for like.
+  old = {(r['id'], r['algo'], r['depth']): r for r in baseline['results']}
+  regressions = 0
+  for result in current['results']:
+    before = old.get((result['id'], result['algo'], result['depth']))
+    if before is None:
+      continue
+    notes = []
+    ratio = result['seconds'] / before['seconds'] if before['seconds'] else 1
+    if ratio > 1 + tolerance and result['seconds'] - before['seconds'] > floor:
+      notes.append(f'{(ratio - 1) * 100:.0f}% slower')
+      regressions += 1
+    if result['nodes'] != before['nodes']:
+      notes.append(f'nodes {before["nodes"]} -> {result["nodes"]}')
+    if result['move'] != before['move']:
+      notes.append(f'move {before["move"]} -> {result["move"]}')
+    if notes:
+      out.write(f'{result["id"]:<22} {result["algo"]:<9} '
+                f'd={result["depth"]}: {", ".join(notes)}\n')
+  for algo, total in current['summary'].items():
+    if algo in baseline['summary']:
+      before = baseline['summary'][algo]['nps']
+      out.write(f'{algo}: {before:.0f} -> {total["nps"]:.0f} nodes/s\n')
+  out.write(f'{regressions} regression(s)\n')
+  return regressions
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('traces', nargs='*',
+                      help='trace files (default: gameTrace-*.txt)')
+  parser.add_argument('-d', '--depths', type=int, nargs='+', default=[2])
+  parser.add_argument('-o', '--output', help='write results to this file')
+  parser.add_argument('--options', default='{}',
+                      help='extra Engine arguments as JSON, '
+                      'e.g. \'{"ordering": true}\'')
+  parser.add_argument('--no-memory', action='store_true',
+                      help='skip the peak memory runs')
+  parser.add_argument('--compare', nargs='+', metavar='FILE',
+                      help='baseline results, and optionally results to '
+                      'compare with instead of running')
+  parser.add_argument('--tolerance', type=float, default=0.1)
+  args = parser.parse_args()
+  if args.compare and len(args.compare) == 2:
+    with open(args.compare[1]) as f:
+      current = json.load(f)
+  else:
+    paths = args.traces or sorted(glob.glob(os.path.join(HERE, 'gameTrace-*.txt')))
+    current = run(paths, args.depths, json.loads(args.options),
+                  not args.no_memory)
+    if args.output:
+      with open(args.output, 'w') as f:
+        json.dump(current, f, indent=1)
+  if args.compare:
+    with open(args.compare[0]) as f:
+      baseline = json.load(f)
+    sys.exit(1 if compare(baseline, current, args.tolerance) else 0)
+
+
+if __name__ == '__main__':
+  main()
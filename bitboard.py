@@ -0,0 +1,503 @@
+# Bitboard representation of a line-em-up position.
+#
+# Cells are stored one bit each in three integers (X stones, O stones and
+# blocks). Rows are laid out with a stride of n + 1 so that every row is
+# followed by an always-empty guard bit; shifting a mask by 1, n, n + 1 or
+# n + 2 therefore walks along a row, an anti-diagonal, a column or a
+# diagonal without wrapping around the board edge.
+#
+# Every length-s segment that could still become a line (the winning
+# windows) is indexed once per (n, s, blocks). Each position keeps per-window
+# X/O counts, which make win detection and e1 incremental on make/unmake.
+# The position also carries a Zobrist hash updated on make/unmake and, on
+# request, the hash of its image under each rotation and reflection that
+# leaves the blocks in place, giving a canonical key for symmetric
+# positions. With track_locality it also counts the stones around every
+# cell, so that the search can stick to the empty cells near the play, and
+# with track_threats it keeps the cells that complete a line for each side.
+
+import sys
+import math as m
+import random
+
+WIN = sys.maxsize - 1
+
+
+def popcount(b):
+  return bin(b).count('1')
+
+
+def bits(b):
+  # Indices of the set bits of b, lowest first (row-major order)
+  while b:
+    low = b & -b
+    yield low.bit_length() - 1
+    b ^= low
+
+
+_windows = {}
+_zobrist = {}
+_neighbourhoods = {}
+_symmetries = {}
+
+
+def zobrist(n):
+  # Fixed per board size so that hashes are stable between runs
+  if n not in _zobrist:
+    rng = random.Random(n)
+    cells = (n + 1) * n
+    _zobrist[n] = tuple(
+        [rng.getrandbits(64) for _ in range(0, cells)] for _ in range(0, 3))
+  return _zobrist[n]
+
+
+def windows(n, s, blocks=0):
+  # Winning windows for a board, as (masks, windows through each cell).
+  # Windows that contain a block can never be completed and are left out.
+  key = (n, s, blocks)
+  if key not in _windows:
+    stride = n + 1
+    masks = []
+    for i in range(0, n):
+      for j in range(0, n):
+        for di, dj in ((0, 1), (1, 0), (1, 1), (1, -1)):
+          if not (0 <= i + (s - 1) * di < n and 0 <= j + (s - 1) * dj < n):
+            continue
+          mask = 0
+          for k in range(0, s):
+            mask |= 1 << ((i + k * di) * stride + j + k * dj)
+          if not mask & blocks:
+            masks.append(mask)
+    through = {}
+    for i in range(0, n):
+      for j in range(0, n):
+        bit = 1 << (i * stride + j)
+        through[i * stride + j] = tuple(
+            w for w, mask in enumerate(masks) if mask & bit)
+    _windows[key] = (masks, through)
+  return _windows[key]
+
+
+def neighbourhoods(n, radius=1):
+  # Mask of the cells within radius (Chebyshev distance) of each cell
+  key = (n, radius)
+  if key not in _neighbourhoods:
+    stride = n + 1
+    masks = {}
+    for i in range(0, n):
+      for j in range(0, n):
+        mask = 0
+        for k in range(max(0, i - radius), min(n, i + radius + 1)):
+          for l in range(max(0, j - radius), min(n, j + radius + 1)):
+            if (k, l) != (i, j):
+              mask |= 1 << (k * stride + l)
+        masks[i * stride + j] = mask
+    _neighbourhoods[key] = masks
+  return _neighbourhoods[key]
+
+
+def from_rows(rows, s):
+  # Board holding a position drawn as rows of '.XO*', stones played in
+  # row-major order
+  blocks = [(i, j)
+            for i, row in enumerate(rows)
+            for j, cell in enumerate(row)
+            if cell == '*']
+  board = Board(len(rows), s, blocks)
+  for i, row in enumerate(rows):
+    for j, cell in enumerate(row):
+      if cell in 'XO':
+        board.play(board.index(i, j), cell)
+  return board
+
+
+def symmetries(n):
+  # The 8 rotations and reflections of the board as cell permutations
+  # (perm[idx] is the cell idx is mapped to), the identity first
+  if n not in _symmetries:
+    last = n - 1
+    maps = (
+        lambda i, j: (i, j),
+        lambda i, j: (j, last - i),
+        lambda i, j: (last - i, last - j),
+        lambda i, j: (last - j, i),
+        lambda i, j: (i, last - j),
+        lambda i, j: (last - i, j),
+        lambda i, j: (j, i),
+        lambda i, j: (last - j, last - i),
+    )
+    stride = n + 1
+    perms = []
+    for f in maps:
+      # Guard bits map to themselves
+      perm = list(range(0, n * stride))
+      for i in range(0, n):
+        for j in range(0, n):
+          (k, l) = f(i, j)
+          perm[i * stride + j] = k * stride + l
+      perms.append(tuple(perm))
+    _symmetries[n] = tuple(perms)
+  return _symmetries[n]
+
+
+def transform(perm, b):
+  # Image of the cell mask b under a cell permutation
+  image = 0
+  for idx in bits(b):
+    image |= 1 << perm[idx]
+  return image
+
+
+def _add(counts, idx):
+  counts[idx] = counts.get(idx, 0) + 1
+
+
+def _drop(counts, idx):
+  if counts[idx] == 1:
+    del counts[idx]
+  else:
+    counts[idx] -= 1
+
+
+class Board:
+
+  def __init__(self, n=3, s=3, blocks=()):
+    self.n = n
+    self.s = s
+    self.stride = n + 1
+    self.directions = (1, self.stride - 1, self.stride, self.stride + 1)
+    self.full = 0
+    for i in range(0, n):
+      for j in range(0, n):
+        self.full |= 1 << self.index(i, j)
+    self.x = 0
+    self.o = 0
+    self.blocks = 0
+    for block in blocks:
+      self.blocks |= 1 << self.index(block[0], block[1])
+    self.free = self.full & ~self.blocks
+    self.empty = popcount(self.free)
+    self.history = []
+    self.xkeys, self.okeys, block_keys = zobrist(n)
+    self.hash = 0
+    for idx in bits(self.blocks):
+      self.hash ^= block_keys[idx]
+    # Symmetries followed by track_symmetries, and the hash of the position
+    # under each of them
+    self.perms = ()
+    self.inverse = ()
+    self.hashes = []
+    # Locality (see track_locality): stones within radius of each cell and
+    # the mask of the cells with at least one
+    self.radius = 0
+    self.around = None
+    self.near = None
+    self.nearby = 0
+    # Threats (see track_threats): cell -> number of windows it completes,
+    # per side
+    self.threats = False
+    self.xthreats = {}
+    self.othreats = {}
+    self.windows, self.through = windows(n, s, self.blocks)
+    self.xcount = [0] * len(self.windows)
+    self.ocount = [0] * len(self.windows)
+    # Completed windows per side and the running e1 total
+    self.xwins = 0
+    self.owins = 0
+    self.score = 0
+    center = n // 2
+    # e2 weights, rounded to a multiple of 2 ** -40: a sum of them is then
+    # exact whatever order it is added up in, so the batched evaluation
+    # gets the same values (and ties) as Board.e2
+    self.weights = {}
+    for i in range(0, n):
+      for j in range(0, n):
+        distance = m.sqrt((i - center)**2 + (j - center)**2)
+        self.weights[self.index(i, j)] = round(
+            (center - distance) * 2**40) / 2**40
+
+  def index(self, i, j):
+    return i * self.stride + j
+
+  def coords(self, idx):
+    return divmod(idx, self.stride)
+
+  def cell(self, i, j):
+    bit = 1 << self.index(i, j)
+    if self.x & bit:
+      return 'X'
+    elif self.o & bit:
+      return 'O'
+    elif self.blocks & bit:
+      return '*'
+    return '.'
+
+  def rows(self):
+    # The position as one '.XO*' string per row
+    return [''.join(self.cell(i, j) for j in range(0, self.n))
+            for i in range(0, self.n)]
+
+  def is_free(self, i, j):
+    return bool(self.free >> self.index(i, j) & 1)
+
+  def empty_cells(self):
+    return bits(self.free)
+
+  def candidates(self):
+    # The moves the search considers: the empty cells within the locality
+    # radius of a stone, or every empty cell when there are none of those
+    # (or locality is not tracked)
+    if self.radius:
+      near = self.free & self.nearby
+      if near:
+        return bits(near)
+    return bits(self.free)
+
+  def play(self, idx, player):
+    # A window scores +#O while it holds only O stones and -#X while it
+    # holds only X stones; adjust the total for the windows through idx
+    bit = 1 << idx
+    s = self.s
+    xcount = self.xcount
+    ocount = self.ocount
+    score = self.score
+    if player == 'X':
+      self.x |= bit
+      self.hash ^= self.xkeys[idx]
+      if self.perms:
+        self.move_hashes(idx, self.xkeys)
+      for w in self.through[idx]:
+        oc = ocount[w]
+        if not oc:
+          score -= 1
+        elif not xcount[w]:
+          score -= oc
+        xcount[w] += 1
+        if xcount[w] == s:
+          self.xwins += 1
+    else:
+      self.o |= bit
+      self.hash ^= self.okeys[idx]
+      if self.perms:
+        self.move_hashes(idx, self.okeys)
+      for w in self.through[idx]:
+        xc = xcount[w]
+        if not xc:
+          score += 1
+        elif not ocount[w]:
+          score += xc
+        ocount[w] += 1
+        if ocount[w] == s:
+          self.owins += 1
+    self.score = score
+    self.free ^= bit
+    self.empty -= 1
+    if self.radius:
+      self.count_near(idx, 1)
+    if self.threats:
+      self.play_threats(idx, player)
+    self.history.append(idx)
+
+  def undo(self, idx, player):
+    bit = 1 << idx
+    s = self.s
+    xcount = self.xcount
+    ocount = self.ocount
+    score = self.score
+    if player == 'X':
+      self.x ^= bit
+      self.hash ^= self.xkeys[idx]
+      if self.perms:
+        self.move_hashes(idx, self.xkeys)
+      for w in self.through[idx]:
+        if xcount[w] == s:
+          self.xwins -= 1
+        xcount[w] -= 1
+        oc = ocount[w]
+        if not oc:
+          score += 1
+        elif not xcount[w]:
+          score += oc
+    else:
+      self.o ^= bit
+      self.hash ^= self.okeys[idx]
+      if self.perms:
+        self.move_hashes(idx, self.okeys)
+      for w in self.through[idx]:
+        if ocount[w] == s:
+          self.owins -= 1
+        ocount[w] -= 1
+        xc = xcount[w]
+        if not xc:
+          score -= 1
+        elif not ocount[w]:
+          score -= xc
+    self.score = score
+    self.free |= bit
+    self.empty += 1
+    if self.radius:
+      self.count_near(idx, -1)
+    if self.threats:
+      self.undo_threats(idx, player)
+    self.history.pop()
+
+  def track_symmetries(self, weighted=True):
+    # Follow the position under every symmetry that maps the blocks (and,
+    # when weighted, the e2 weights) onto themselves, so that it evaluates
+    # the same as its images. Only the identity and the transpose keep the
+    # weights of an even board, whose centre cell is off the middle.
+    # Returns the number of symmetries, 1 meaning none are followed.
+    perms = []
+    for perm in symmetries(self.n):
+      if transform(perm, self.blocks) != self.blocks:
+        continue
+      if weighted and any(self.weights[perm[idx]] != weight
+                          for idx, weight in self.weights.items()):
+        continue
+      perms.append(perm)
+    if len(perms) == 1:
+      perms = []
+    self.perms = tuple(perms)
+    self.inverse = tuple(
+        tuple(sorted(range(0, len(perm)), key=perm.__getitem__))
+        for perm in perms)
+    self.hashes = []
+    for perm in perms:
+      h = self.hash
+      for idx in bits(self.x):
+        h ^= self.xkeys[idx] ^ self.xkeys[perm[idx]]
+      for idx in bits(self.o):
+        h ^= self.okeys[idx] ^ self.okeys[perm[idx]]
+      self.hashes.append(h)
+    return len(perms) or 1
+
+  def move_hashes(self, idx, keys):
+    hashes = self.hashes
+    for k, perm in enumerate(self.perms):
+      hashes[k] ^= keys[perm[idx]]
+
+  def canonical(self):
+    # (key, k): the smallest hash over the followed symmetries and the
+    # symmetry giving it, whose inverse maps moves back to this position
+    hashes = self.hashes
+    key = min(hashes)
+    return (key, hashes.index(key))
+
+  def stabilizer(self):
+    # The followed symmetries that map the position onto itself
+    h = self.hash
+    return [perm for perm, image in zip(self.perms, self.hashes) if image == h]
+
+  def track_locality(self, radius=1):
+    # Count the stones within radius (Chebyshev distance) of every cell on
+    # make/unmake, for candidates
+    self.radius = radius
+    self.around = {
+        idx: tuple(bits(mask))
+        for idx, mask in neighbourhoods(self.n, radius).items()
+    }
+    self.near = [0] * (self.n * self.stride)
+    self.nearby = 0
+    for idx in bits(self.x | self.o):
+      self.count_near(idx, 1)
+
+  def count_near(self, idx, step):
+    near = self.near
+    for k in self.around[idx]:
+      count = near[k] + step
+      near[k] = count
+      if count == 0:
+        self.nearby ^= 1 << k
+      elif count == 1 and step == 1:
+        self.nearby |= 1 << k
+
+  def track_threats(self):
+    # Keep, on make/unmake, the empty cells that would complete a window
+    # for X and for O: the windows holding s - 1 stones of one side and
+    # none of the other
+    self.threats = True
+    self.xthreats = {}
+    self.othreats = {}
+    s1 = self.s - 1
+    for w, mask in enumerate(self.windows):
+      if self.xcount[w] == s1 and not self.ocount[w]:
+        _add(self.xthreats, (mask & self.free).bit_length() - 1)
+      elif self.ocount[w] == s1 and not self.xcount[w]:
+        _add(self.othreats, (mask & self.free).bit_length() - 1)
+
+  def play_threats(self, idx, player):
+    # After idx was played (counts and free already updated)
+    if player == 'X':
+      own, other = self.xcount, self.ocount
+      mine, theirs = self.xthreats, self.othreats
+    else:
+      own, other = self.ocount, self.xcount
+      mine, theirs = self.othreats, self.xthreats
+    s1 = self.s - 1
+    for w in self.through[idx]:
+      if other[w]:
+        if own[w] == 1 and other[w] == s1:
+          # Blocked a threat of the other side
+          _drop(theirs, idx)
+      elif own[w] == s1:
+        _add(mine, (self.windows[w] & self.free).bit_length() - 1)
+      elif own[w] == s1 + 1:
+        _drop(mine, idx)
+
+  def undo_threats(self, idx, player):
+    # After idx was taken back (counts and free already restored)
+    if player == 'X':
+      own, other = self.xcount, self.ocount
+      mine, theirs = self.xthreats, self.othreats
+    else:
+      own, other = self.ocount, self.xcount
+      mine, theirs = self.othreats, self.xthreats
+    s1 = self.s - 1
+    for w in self.through[idx]:
+      if other[w]:
+        if not own[w] and other[w] == s1:
+          _add(theirs, idx)
+      elif own[w] == s1:
+        _add(mine, idx)
+      elif own[w] == s1 - 1:
+        _drop(mine, (self.windows[w] & self.free & ~(1 << idx)).bit_length() - 1)
+
+  def rewind(self, length):
+    # Take back moves until only the first length remain
+    while len(self.history) > length:
+      idx = self.history[-1]
+      self.undo(idx, 'X' if self.x >> idx & 1 else 'O')
+
+  def winner(self):
+    if self.xwins:
+      return 'X'
+    elif self.owins:
+      return 'O'
+    return None
+
+  def result(self):
+    # Same encoding as Game.is_end: 'X'/'O' for a win, '.' for a tie and
+    # None while the game is still going
+    if self.xwins:
+      return 'X'
+    elif self.owins:
+      return 'O'
+    elif self.empty:
+      return None
+    return '.'
+
+  def e1(self):
+    if self.xwins:
+      return -WIN
+    elif self.owins:
+      return WIN
+    return self.score
+
+  def e2(self):
+    weights = self.weights
+    score = 0
+    for idx in bits(self.o):
+      score += weights[idx]
+    for idx in bits(self.x):
+      score -= weights[idx]
+    return score
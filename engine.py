@@ -0,0 +1,1316 @@
+# Search engine for line-em-up, independent of any console or file output.
+#
+# Engine holds a position and everything the search needs (transposition
+# table, move ordering, worker pool) and returns each result as a move
+# record. best_move is the headless entry point: give it a position and the
+# side to move and it returns the chosen move with its search statistics.
+# The interactive game and the scoreboard tournament are a driver on top of
+# this (Game in skeleton-tictactoe.py).
+
+import time
+import functools
+import threading
+import multiprocessing
+from collections import Counter
+
+from bitboard import Board, WIN, bits, popcount, from_rows
+from transposition import TranspositionTable, EXACT, LOWER, UPPER
+from ordering import HeuristicOrdering
+from leafeval import BatchEvaluator, BATCH_MIN, np
+from solved import SolvedTable
+from mcts import MCTS
+
+class SearchTimeout(Exception):
+  pass
+
+
+# negamax scores a win as WIN minus the plies from the root to it; values
+# beyond MATE are such wins
+MATE = WIN - 1000
+
+
+def _to_tt(value, ply):
+  # Wins are stored as plies from the node, so that the entry holds
+  # wherever the position is reached
+  if value > MATE:
+    return value + ply
+  elif value < -MATE:
+    return value - ply
+  return value
+
+
+def _from_tt(value, ply):
+  if value > MATE:
+    return value - ply
+  elif value < -MATE:
+    return value + ply
+  return value
+
+
+# Search state of a pool worker process, one Engine per worker
+_worker = None
+
+
+def _init_worker(config):
+  global _worker
+  _worker = Engine(**config)
+
+
+def _search_child(task):
+  # Search one root move of the position given by its move history and
+  # return its value (None if the time ran out) with the search counters
+  (algo, history, x, idx, max, d, start, limit) = task
+  game = _worker
+  board = game.board
+  board.rewind(0)
+  for k in history:
+    board.play(k, 'X' if x >> k & 1 else 'O')
+  board.play(idx, 'O' if max else 'X')
+  game.depth_evals = Counter()
+  game.e1_invocations = 0
+  game.e2_invocations = 0
+  game.invocations = 0
+  game.truncated = False
+  game.nodes = 0
+  game.interior = 0
+  game.cutoffs = 0
+  game.next_check = 0
+  game.elapsed = 0
+  if game.ordering is not None:
+    if start != game.search_start:
+      game.ordering.new_search()
+    game.ordering.clear_stats()
+  game.search_start = start
+  game.root_depth = d
+  game.use_tt(algo)
+  try:
+    if algo == Engine.MINIMAX:
+      (v, _, _) = game.minimax(max=not max,
+                               d=d,
+                               start=start,
+                               limit=limit,
+                               current=1)
+    elif algo == Engine.NEGAMAX:
+      (v, _, _) = game.negamax(max=not max,
+                               d=d,
+                               start=start,
+                               limit=limit,
+                               current=1)
+      # From the side to move after idx back to O's point of view
+      if max:
+        v = -v
+    else:
+      (v, _, _) = game.alphabeta(max=not max,
+                                 d=d,
+                                 start=start,
+                                 limit=limit,
+                                 current=1)
+  except SearchTimeout:
+    v = None
+  counters = {
+      'depth_evals': game.depth_evals,
+      'e1_invocations': game.e1_invocations,
+      'e2_invocations': game.e2_invocations,
+      'invocations': game.invocations,
+      'nodes': game.nodes,
+      'interior': game.interior,
+      'cutoffs': game.cutoffs,
+  }
+  if game.ordering is not None:
+    counters['ordering'] = (game.ordering.nodes, game.ordering.cutoffs,
+                            game.ordering.first_cutoffs)
+  return (idx, v, game.truncated, counters)
+
+
+def _mcts_child(task):
+  # Grow the worker's own tree for the position given by its move history
+  # and return the root's visit counts with the search statistics
+  (history, x, player, start, limit, budget, seed) = task
+  game = _worker
+  board = game.board
+  board.rewind(0)
+  for k in history:
+    board.play(k, 'X' if x >> k & 1 else 'O')
+  game.depth_evals = Counter()
+  game.truncated = False
+  if game.tree is not None and seed is not None:
+    game.tree.rng.seed(seed)
+  (iterations, deepest) = game.grow(player, start, limit, budget)
+  tree = game.tree
+  return (tree.children(), (iterations, deepest, tree.size(), tree.nbytes(),
+                            game.depth_evals, game.truncated))
+
+
+class Engine:
+  MINIMAX = 0
+  ALPHABETA = 1
+  # 2 and 3 are Game.HUMAN and Game.AI
+  NEGAMAX = 4
+  MCTS = 5
+
+  def __init__(self,
+               n=3,
+               blocks=[],
+               s=3,
+               depth1=0,
+               depth2=0,
+               e1=1,
+               e2=2,
+               t=10,
+               tt_entries=None,
+               tt_bytes=None,
+               deepening=False,
+               ordering=None,
+               workers=None,
+               batch=True,
+               nodes=None,
+               check_every=1,
+               telemetry=None,
+               symmetry=False,
+               radius=None,
+               threats=False,
+               quiescence=0,
+               aspiration=2,
+               solved=(),
+               playout='random',
+               exploration=1.4,
+               playouts=None,
+               tree_nodes=1 << 20,
+               seed=None):
+    E = {1: self.e1, 2: self.e2}
+    self.heuristics = (e1, e2)
+    # Horizon nodes are scored in one NumPy call when it is available
+    self.batch = batch and np is not None
+    self.evaluator = None
+    # Follow the rotations and reflections that keep the blocks and the
+    # evaluation, to skip symmetric duplicate moves and share TT entries
+    self.symmetry = symmetry
+    # Only search the empty cells within radius of a stone
+    self.radius = radius
+    # Answer immediate wins, lost positions and forced blocks without a full
+    # width search, following forced blocks up to quiescence plies past the
+    # horizon
+    self.threats = threats
+    self.quiescence = quiescence if threats else 0
+    self.root_depth = 0
+    # Half-width of the negamax aspiration window around the score of the
+    # previous iteration; 0 searches every iteration with a full window
+    self.aspiration = aspiration
+    self.root_score = None
+    # Solved-position files (see solved.py); a position of a board one of
+    # them matches is answered from the file without a search
+    self.solved = [SolvedTable(path) for path in solved]
+    self.solved_hit = False
+    # Monte Carlo tree search: playout policy, UCB1 exploration constant,
+    # playouts per move (used up to the time limit, which is all it has
+    # without one) and the tree kept between moves
+    self.playout = playout
+    self.exploration = exploration
+    self.playouts = playouts
+    self.tree_nodes = tree_nodes
+    self.seed = seed
+    self.tree = None
+    self.mcts_stats = None
+    self.n = n
+    self.s = s
+    self.blocks = []
+    self.initialize_game()
+    if blocks:
+      self.add_blocks(blocks)
+    self.depth1 = depth1
+    self.depth2 = depth2
+    self.max_depth = max(depth1, depth2)
+    self.score1 = E[e1]
+    self.score2 = E[e2]
+    self.time_limit = t
+    # Transposition table shared by every search of this engine
+    self.tt = None
+    if tt_entries or tt_bytes:
+      self.tt = TranspositionTable(entries=tt_entries, max_bytes=tt_bytes)
+    self.truncated = False
+    self.timed_out = False
+    # A node budget makes the search reproducible: it is stopped after that
+    # many nodes per move by the iterative deepening driver, and the clock
+    # (if t is not None) is only read every check_every nodes
+    self.node_budget = float('inf') if nodes is None else nodes
+    self.check_every = check_every
+    # Event that abandons the search in progress (see Ponder)
+    self.stop = None
+    # Called after each iteration of iterative deepening with the engine,
+    # the depth, its result and the time spent; a true return ends the
+    # search there (see TimeManager)
+    self.on_iteration = None
+    self.nodes = 0
+    self.next_check = 0
+    self.elapsed = 0
+    # Per-move search counters, reported through the move records
+    self.depth_evals = Counter()
+    self.interior = 0
+    self.cutoffs = 0
+    self.researches = 0
+    self.records = []
+    self.telemetry = telemetry
+    # Iterative deepening stops exactly at the limit instead of cutting the
+    # search short half a second early
+    self.deepening = deepening or nodes is not None
+    self.margin = 0 if self.deepening else 0.5
+    self.depth_reached = None
+    # Child ordering for alphabeta; None keeps the plain row-major loop
+    if ordering is True:
+      ordering = HeuristicOrdering()
+    self.ordering = ordering
+    self.root_pv = None
+    self.search_start = None
+    # Root moves are split over this many processes; the pool is created on
+    # the first search and reused until close
+    self.workers = workers
+    self.pool = None
+    # What a worker process needs to rebuild an equivalent engine
+    self.config = {
+        'n': n,
+        's': s,
+        'blocks': list(blocks),
+        'depth1': depth1,
+        'depth2': depth2,
+        'e1': e1,
+        'e2': e2,
+        't': t,
+        'tt_entries': tt_entries,
+        'tt_bytes': tt_bytes,
+        'deepening': deepening,
+        'ordering': ordering and type(ordering)(),
+        'batch': batch,
+        'nodes': nodes,
+        'check_every': check_every,
+        'symmetry': symmetry,
+        'radius': radius,
+        'threats': threats,
+        'quiescence': quiescence,
+        'aspiration': aspiration,
+        'solved': list(solved),
+        'playout': playout,
+        'exploration': exploration,
+        'playouts': playouts,
+        'tree_nodes': tree_nodes,
+        'seed': seed,
+    }
+    self.moves = 0
+    self.e1_invocations = 0
+    self.e2_invocations = 0
+    self.invocations = 0
+
+  def initialize_game(self):
+
+    self.board = self.new_board()
+    # Player X always plays first
+    self.player_turn = 'X'
+
+  def new_board(self):
+    board = Board(self.n, self.s, self.blocks)
+    if self.symmetry:
+      board.track_symmetries(weighted=2 in self.heuristics)
+    if self.radius:
+      board.track_locality(self.radius)
+    if self.threats or self.playout == 'heuristic':
+      board.track_threats()
+    return board
+
+  def is_valid(self, px, py):
+    if px < 0 or px > self.n - 1 or py < 0 or py > self.n - 1:
+      return False
+    elif not self.board.is_free(px, py):
+      return False
+    else:
+      return True
+
+  def is_end(self):
+    return self.board.result()
+
+  def switch_player(self):
+    self.moves += 1
+    if self.player_turn == 'X':
+      self.player_turn = 'O'
+    elif self.player_turn == 'O':
+      self.player_turn = 'X'
+    return self.player_turn
+
+  def horizon(self, max, moves=None):
+    # Static evaluation of every child (or of the given moves) of a node at
+    # the depth limit
+    board = self.board
+    if moves is None:
+      if self.batch and board.empty >= BATCH_MIN:
+        return self.batch_horizon(max)
+      moves = board.candidates()
+    value = float('inf')
+    if max:
+      value = float('-inf')
+    move = None
+    for idx in moves:
+      if max:
+        board.play(idx, 'O')
+        v = self.score1()
+        board.undo(idx, 'O')
+        if v > value:
+          value = v
+          move = idx
+      else:
+        board.play(idx, 'X')
+        v = self.score2()
+        board.undo(idx, 'X')
+        if v < value:
+          value = v
+          move = idx
+    return (value, move)
+
+  def batch_horizon(self, max):
+    if self.evaluator is None:
+      self.evaluator = BatchEvaluator(self.board)
+    heuristic = self.heuristics[0 if max else 1]
+    (value, move, children) = self.evaluator.best(self.board, max, heuristic)
+    self.invocations += children
+    if heuristic == 1:
+      self.e1_invocations += children
+    else:
+      self.e2_invocations += children
+    return (value, move)
+
+  def probe(self):
+    if self.tt is None:
+      return None
+    board = self.board
+    if not board.perms:
+      return self.tt.probe(board.hash)
+    # Entries are kept for the canonical image of the position, with the
+    # move mapped into that image
+    (key, k) = board.canonical()
+    entry = self.tt.probe(key)
+    if entry is None or entry[3] is None:
+      return entry
+    return entry[:3] + (board.inverse[k][entry[3]],)
+
+  def store(self, value, remaining, flag, move):
+    if self.tt is not None and not self.truncated:
+      board = self.board
+      if not board.perms:
+        self.tt.store(board.hash, value, remaining, flag, move)
+        return
+      (key, k) = board.canonical()
+      if move is not None:
+        move = board.perms[k][move]
+      self.tt.store(key, value, remaining, flag, move)
+
+  def forced(self, max):
+    # Threat stage: (value, move, None) when the side to move can complete
+    # a line, or cannot stop the other side from completing one (two or
+    # more threats); (None, None, moves) when it has to block a single
+    # threat; (None, None, None) when it is free to play anywhere
+    board = self.board
+    if max:
+      (own, other, sign) = (board.othreats, board.xthreats, 1)
+    else:
+      (own, other, sign) = (board.xthreats, board.othreats, -1)
+    if own:
+      return (sign * WIN, min(own), None)
+    if len(other) > 1:
+      return (-sign * WIN, min(other), None)
+    if other:
+      return (None, None, list(other))
+    return (None, None, None)
+
+  def distinct(self, moves):
+    # Moves with symmetric duplicates removed, keeping the first of each
+    # set in the given order. A symmetry of the position leads to children
+    # of equal value, so the search result does not change.
+    board = self.board
+    if not board.perms:
+      return moves
+    stabilizer = board.stabilizer()
+    if len(stabilizer) == 1:
+      return moves
+    kept = []
+    images = set()
+    for idx in moves:
+      if idx not in images:
+        kept.append(idx)
+        images.update(perm[idx] for perm in stabilizer)
+    return kept
+
+  def clock(self, start, limit):
+    # Time spent on the search so far; raises SearchTimeout once the node
+    # budget or, when deepening, the time limit is used up, or when stop is
+    # set
+    self.nodes += 1
+    if self.nodes > self.node_budget:
+      raise SearchTimeout()
+    if self.nodes >= self.next_check:
+      self.next_check = self.nodes + self.check_every
+      if self.stop is not None and self.stop.is_set():
+        raise SearchTimeout()
+      if limit != float('inf'):
+        self.elapsed = time.time() - start
+        if self.elapsed >= limit and self.deepening:
+          raise SearchTimeout()
+    return self.elapsed
+
+  def minimax(self, max=False, d=0, start=0, limit=10, current=0):
+    # Minimizing for 'X' and maximizing for 'O'
+    # Possible values are:
+    # -maxint - win for 'X'
+    # 0  - a tie
+    # maxint  - loss for 'X'
+    # We're initially setting it to inf or -inf as worse than the worst case:
+    t = self.clock(start, limit)
+    value = float('inf')
+    if max:
+      value = float('-inf')
+    x = None
+    y = None
+    result = self.is_end()
+    if result == 'X':
+      self.depth_evals[current] += 1
+      return (-WIN, x, y)
+    elif result == 'O':
+      self.depth_evals[current] += 1
+      return (WIN, x, y)
+    elif result == '.':
+      self.depth_evals[current] += 1
+      return (0, x, y)
+    board = self.board
+    remaining = d - current
+    entry = self.probe()
+    if entry is not None and entry[1] >= remaining and entry[2] == EXACT:
+      self.depth_evals[current] += 1
+      x, y = board.coords(entry[3])
+      return (entry[0], x, y)
+    forced = None
+    if self.threats:
+      (v, move, forced) = self.forced(max)
+      if v is not None:
+        self.depth_evals[current] += 1
+        x, y = board.coords(move)
+        return (v, x, y)
+      if (forced is not None and current == d and
+          d < self.root_depth + self.quiescence):
+        # Quiescence: follow a forced block past the horizon
+        d += 1
+    if current == d or t >= (limit - self.margin):  #max depth reached or time
+      if current < d:
+        self.truncated = True
+      (value, move) = self.horizon(max, forced)
+      self.store(value, remaining, EXACT, move)
+      x, y = board.coords(move)
+      self.depth_evals[current] += 1
+      return (value, x, y)
+    current += 1
+    self.interior += 1
+    move = None
+    moves = forced
+    if moves is None:
+      moves = self.distinct(board.candidates())
+    for idx in moves:
+      if max:
+        board.play(idx, 'O')
+        (v, _, _) = self.minimax(max=False,
+                                 d=d,
+                                 start=start,
+                                 limit=limit,
+                                 current=current)
+        board.undo(idx, 'O')
+        if v > value:
+          value = v
+          move = idx
+      else:
+        board.play(idx, 'X')
+        (v, _, _) = self.minimax(max=True,
+                                 d=d,
+                                 start=start,
+                                 limit=limit,
+                                 current=current)
+        board.undo(idx, 'X')
+        if v < value:
+          value = v
+          move = idx
+    self.store(value, remaining, EXACT, move)
+    if move is not None:
+      x, y = board.coords(move)
+    self.depth_evals[current] += 1
+    return (value, x, y)
+
+  def alphabeta(self,
+                alpha=float('-inf'),
+                beta=float('inf'),
+                max=False,
+                d=0,
+                start=0,
+                limit=10,
+                current=0):
+    # Minimizing for 'X' and maximizing for 'O'
+    # Possible values are:
+    # -maxint - win for 'X'
+    # 0  - a tie
+    # maxint  - loss for 'X'
+    # The window starts unbounded so the root value is exact
+    t = self.clock(start, limit)
+    value = float('inf')
+    if max:
+      value = float('-inf')
+    x = None
+    y = None
+    result = self.is_end()
+    # print(start, t, limit)
+    if result == 'X':
+      self.depth_evals[current] += 1
+      return (-WIN, x, y)
+    elif result == 'O':
+      self.depth_evals[current] += 1
+      return (WIN, x, y)
+    elif result == '.':
+      self.depth_evals[current] += 1
+      return (0, x, y)
+    board = self.board
+    remaining = d - current
+    entry = self.probe()
+    pv = None
+    if entry is not None:
+      (v, depth, flag, pv) = entry
+      if depth >= remaining and (flag == EXACT or
+                                 (flag == LOWER and v >= beta) or
+                                 (flag == UPPER and v <= alpha)):
+        self.depth_evals[current] += 1
+        x, y = board.coords(pv)
+        return (v, x, y)
+    forced = None
+    if self.threats:
+      (v, move, forced) = self.forced(max)
+      if v is not None:
+        self.depth_evals[current] += 1
+        x, y = board.coords(move)
+        return (v, x, y)
+      if (forced is not None and current == d and
+          d < self.root_depth + self.quiescence):
+        # Quiescence: follow a forced block past the horizon
+        d += 1
+    if current == d or t >= (limit - self.margin):  #max depth or time reached
+      if current < d:
+        self.truncated = True
+      if t >= limit:
+        self.timed_out = True
+        if max: return (float('-inf'), x, y)
+        else: return (float('inf'), x, y)
+      (value, move) = self.horizon(max, forced)
+      self.store(value, remaining, EXACT, move)
+      x, y = board.coords(move)
+      self.depth_evals[current] += 1
+      return (value, x, y)
+    ply = current
+    current += 1
+    self.interior += 1
+    alpha0 = alpha
+    beta0 = beta
+    move = None
+    ordering = self.ordering
+    if forced is not None:
+      moves = forced
+    elif ordering is None:
+      moves = self.distinct(board.candidates())
+    else:
+      if ply == 0 and pv is None:
+        pv = self.root_pv
+      moves = self.distinct(ordering.order(board, ply, max, pv))
+    for i, idx in enumerate(moves):
+      if max:
+        board.play(idx, 'O')
+        (v, _, _) = self.alphabeta(alpha,
+                                   beta,
+                                   max=False,
+                                   d=d,
+                                   start=start,
+                                   limit=limit,
+                                   current=current)
+        board.undo(idx, 'O')
+        if v > value:
+          value = v
+          move = idx
+      else:
+        board.play(idx, 'X')
+        (v, _, _) = self.alphabeta(alpha,
+                                   beta,
+                                   max=True,
+                                   d=d,
+                                   start=start,
+                                   limit=limit,
+                                   current=current)
+        board.undo(idx, 'X')
+        if v < value:
+          value = v
+          move = idx
+      if max:
+        if value >= beta:
+          self.cutoffs += 1
+          if ordering is not None:
+            ordering.cutoff(idx, ply, max, remaining, i)
+          break
+        if value > alpha:
+          alpha = value
+      else:
+        if value <= alpha:
+          self.cutoffs += 1
+          if ordering is not None:
+            ordering.cutoff(idx, ply, max, remaining, i)
+          break
+        if value < beta:
+          beta = value
+    if value <= alpha0:
+      flag = UPPER
+    elif value >= beta0:
+      flag = LOWER
+    else:
+      flag = EXACT
+    self.store(value, remaining, flag, move)
+    if move is not None:
+      x, y = board.coords(move)
+    self.depth_evals[current] += 1
+    return (value, x, y)
+
+  def lookup(self):
+    # (value, x, y) of the position from a matching solved table, or None
+    board = self.board
+    for table in self.solved:
+      if table.matches(board):
+        entry = table.lookup(board)
+        if entry is not None and entry[1] is not None:
+          x, y = board.coords(entry[1])
+          return (entry[0], x, y)
+    return None
+
+  def playout_budget(self, limit):
+    # Playouts per move: the configured number, as many as the time limit
+    # allows otherwise, and a fixed number when there is neither; a node
+    # budget counts playouts
+    if self.playouts is not None:
+      budget = self.playouts
+    elif limit == float('inf'):
+      budget = 10000
+    else:
+      budget = float('inf')
+    return min(budget, self.node_budget)
+
+  def grow(self, player, start, limit, budget):
+    # Run tree iterations from the current position, at least one and then
+    # up to the time limit itself (the tree can stop after any iteration);
+    # returns the number of iterations and the depth of the deepest leaf
+    if self.tree is None:
+      self.tree = MCTS(c=self.exploration,
+                       playout=self.playout,
+                       max_nodes=self.tree_nodes,
+                       seed=self.seed)
+    tree = self.tree
+    tree.reroot(self.board)
+    iterations = 0
+    deepest = 0
+    while True:
+      depth = tree.iterate(self.board, player)
+      self.depth_evals[depth] += 1
+      iterations += 1
+      if depth > deepest:
+        deepest = depth
+      if iterations >= budget:
+        break
+      if ((limit != float('inf') and time.time() - start >= limit) or
+          (self.stop is not None and self.stop.is_set())):
+        # Stopped by the clock rather than the playout budget
+        self.truncated = True
+        break
+    return (iterations, deepest)
+
+  def mcts(self, max, start, limit):
+    # Monte Carlo tree search of the current position. With workers, each
+    # one grows its own tree for the same position and their root visit
+    # counts are added up (root parallelism).
+    board = self.board
+    player = 'O' if max else 'X'
+    budget = self.playout_budget(limit)
+    if self.workers:
+      tasks = [(tuple(board.history), board.x, player, start, limit,
+                budget / self.workers,
+                None if self.seed is None else self.seed + k)
+               for k in range(0, self.workers)]
+      children = {}
+      iterations = 0
+      deepest = 0
+      tree_nodes = 0
+      tree_bytes = 0
+      for (counts, stats) in self.worker_pool().imap_unordered(
+          _mcts_child, tasks):
+        for move, (visits, wins) in counts.items():
+          (v, w) = children.get(move, (0, 0.0))
+          children[move] = (v + visits, w + wins)
+        iterations += stats[0]
+        if stats[1] > deepest:
+          deepest = stats[1]
+        tree_nodes += stats[2]
+        tree_bytes += stats[3]
+        self.depth_evals += stats[4]
+        self.truncated = self.truncated or stats[5]
+    else:
+      (iterations, deepest) = self.grow(player, start, limit, budget)
+      children = self.tree.children()
+      tree_nodes = self.tree.size()
+      tree_bytes = self.tree.nbytes()
+    # The most visited move, and its win rate as a value from -1 (X wins)
+    # to 1 (O wins)
+    move = None
+    visits = -1
+    rate = 0.5
+    for idx in sorted(children):
+      (v, w) = children[idx]
+      if v > visits:
+        (move, visits) = (idx, v)
+        rate = w / v if v else 0.5
+    value = 2 * rate - 1 if max else 1 - 2 * rate
+    elapsed = time.time() - start
+    self.nodes = iterations
+    self.depth_reached = deepest
+    self.mcts_stats = {
+        'iterations': iterations,
+        'iterations_per_sec': iterations / elapsed if elapsed else 0.0,
+        'tree_nodes': tree_nodes,
+        'tree_bytes': tree_bytes,
+    }
+    x, y = board.coords(move)
+    return (value, x, y)
+
+  def pvs(self, max=False, d=0, start=0, limit=10):
+    # Root of the negamax search. When deepening, the window is centred on
+    # the score of the previous iteration and widened on the side the score
+    # falls outside of. The value is returned with alphabeta's sign.
+    alpha = float('-inf')
+    beta = float('inf')
+    score = self.root_score
+    if self.aspiration and score is not None and abs(score) < MATE:
+      alpha = score - self.aspiration
+      beta = score + self.aspiration
+    while True:
+      (value, x, y) = self.negamax(alpha, beta, max, d, start, limit)
+      if value <= alpha and alpha != float('-inf'):
+        alpha = float('-inf')
+      elif value >= beta and beta != float('inf'):
+        beta = float('inf')
+      else:
+        break
+      self.researches += 1
+    self.root_score = value
+    return (value if max else -value, x, y)
+
+  def negamax(self,
+              alpha=float('-inf'),
+              beta=float('inf'),
+              max=False,
+              d=0,
+              start=0,
+              limit=10,
+              current=0):
+    # Principal-variation negamax. Values are from the point of view of the
+    # side to move ('O' when max) and fail soft; a win is worth WIN minus
+    # the plies to it from the root, so the quickest win is preferred.
+    t = self.clock(start, limit)
+    board = self.board
+    result = self.is_end()
+    if result is not None:
+      self.depth_evals[current] += 1
+      if result == '.':
+        return (0, None, None)
+      # Only the side that just moved can have completed a line
+      return (current - WIN, None, None)
+    remaining = d - current
+    entry = self.probe()
+    pv = None
+    if entry is not None:
+      (v, depth, flag, pv) = entry
+      v = _from_tt(v, current)
+      if depth >= remaining and pv is not None and (
+          flag == EXACT or (flag == LOWER and v >= beta) or
+          (flag == UPPER and v <= alpha)):
+        self.depth_evals[current] += 1
+        x, y = board.coords(pv)
+        return (v, x, y)
+    forced = None
+    if self.threats:
+      (v, move, forced) = self.forced(max)
+      if v is not None:
+        self.depth_evals[current] += 1
+        x, y = board.coords(move)
+        if (v > 0) == max:
+          return (WIN - current - 1, x, y)
+        return (current + 2 - WIN, x, y)
+      if (forced is not None and current == d and
+          d < self.root_depth + self.quiescence):
+        d += 1
+    if current == d or t >= (limit - self.margin):  #max depth or time reached
+      if current < d:
+        self.truncated = True
+      if t >= limit:
+        self.timed_out = True
+      (value, move) = self.horizon(max, forced)
+      if not max:
+        value = -value
+      if value == WIN:
+        value = WIN - current - 1
+      elif value == -WIN:
+        value = current + 1 - WIN
+      self.store(_to_tt(value, current), remaining, EXACT, move)
+      x, y = board.coords(move)
+      self.depth_evals[current] += 1
+      return (value, x, y)
+    ply = current
+    current += 1
+    self.interior += 1
+    alpha0 = alpha
+    beta0 = beta
+    ordering = self.ordering
+    if forced is not None:
+      moves = forced
+    elif ordering is None:
+      moves = self.distinct(board.candidates())
+    else:
+      if ply == 0 and pv is None:
+        pv = self.root_pv
+      moves = self.distinct(ordering.order(board, ply, max, pv))
+    player = 'O' if max else 'X'
+    value = float('-inf')
+    move = None
+    for i, idx in enumerate(moves):
+      board.play(idx, player)
+      if i == 0:
+        v = -self.negamax(-beta, -alpha, not max, d, start, limit, current)[0]
+      else:
+        # Null window: only find out whether idx beats alpha, and search it
+        # again with the full window if it does. Any width works for that;
+        # 1 keeps win scores (ints near WIN) exact.
+        v = -self.negamax(-alpha - 1, -alpha, not max, d, start, limit,
+                          current)[0]
+        if alpha < v < beta:
+          self.researches += 1
+          v = -self.negamax(-beta, -alpha, not max, d, start, limit,
+                            current)[0]
+      board.undo(idx, player)
+      if v > value:
+        value = v
+        move = idx
+      if value >= beta:
+        self.cutoffs += 1
+        if ordering is not None:
+          ordering.cutoff(idx, ply, max, remaining, i)
+        break
+      if value > alpha:
+        alpha = value
+    if value <= alpha0:
+      flag = UPPER
+    elif value >= beta0:
+      flag = LOWER
+    else:
+      flag = EXACT
+    self.store(_to_tt(value, ply), remaining, flag, move)
+    x, y = board.coords(move)
+    self.depth_evals[current] += 1
+    return (value, x, y)
+
+  def worker_pool(self):
+    if self.pool is None:
+      self.pool = multiprocessing.Pool(self.workers,
+                                       initializer=_init_worker,
+                                       initargs=(self.config,))
+    return self.pool
+
+  def close(self):
+    if self.pool is not None:
+      self.pool.terminate()
+      self.pool.join()
+      self.pool = None
+
+  def split(self, algo, max=False, d=0, start=0, limit=10):
+    # Parallel root search: every root move is searched with a full window
+    # in a worker, so each value is exact and taking the first best move in
+    # root order picks the same move as the serial search
+    board = self.board
+    if d == 0:
+      (value, move) = self.horizon(max)
+      x, y = board.coords(move)
+      self.depth_evals[0] += 1
+      return (value, x, y)
+    pv = self.root_pv
+    entry = self.probe()
+    if entry is not None:
+      (v, depth, flag, move) = entry
+      if depth >= d and flag == EXACT and move is not None:
+        # A finished search of this position (pondered or from an earlier
+        # move) answers it, as it does in the serial search
+        if algo == self.NEGAMAX and not max:
+          v = -v
+        x, y = board.coords(move)
+        self.depth_evals[0] += 1
+        return (v, x, y)
+      pv = move
+    forced = None
+    if self.threats:
+      (v, move, forced) = self.forced(max)
+      if v is not None:
+        if algo == self.NEGAMAX:
+          # Wins by their distance, as negamax scores them at the root
+          v = WIN - 1 if (v > 0) == max else 2 - WIN
+          if not max:
+            v = -v
+        x, y = board.coords(move)
+        self.depth_evals[0] += 1
+        return (v, x, y)
+    if forced is not None:
+      moves = forced
+    elif self.ordering is None or algo == self.MINIMAX:
+      moves = list(board.candidates())
+    else:
+      moves = list(self.ordering.order(board, 0, max, pv))
+    moves = self.distinct(moves)
+    history = tuple(board.history)
+    tasks = [(algo, history, board.x, idx, max, d, start, limit)
+             for idx in moves]
+    results = {}
+    self.nodes += 1
+    self.interior += 1
+    for (idx, v, truncated,
+         counters) in self.worker_pool().imap_unordered(_search_child, tasks):
+      results[idx] = v
+      self.truncated = self.truncated or truncated
+      self.depth_evals += counters['depth_evals']
+      self.e1_invocations += counters['e1_invocations']
+      self.e2_invocations += counters['e2_invocations']
+      self.invocations += counters['invocations']
+      self.nodes += counters['nodes']
+      self.interior += counters['interior']
+      self.cutoffs += counters['cutoffs']
+      if 'ordering' in counters:
+        ordering = counters['ordering']
+        self.ordering.nodes += ordering[0]
+        self.ordering.cutoffs += ordering[1]
+        self.ordering.first_cutoffs += ordering[2]
+    if None in results.values():
+      raise SearchTimeout()
+    value = float('-inf') if max else float('inf')
+    move = None
+    for idx in moves:
+      v = results[idx]
+      if (max and v > value) or (not max and v < value):
+        value = v
+        move = idx
+    # negamax keeps its entries from the point of view of the side to move
+    if algo == self.NEGAMAX and not max:
+      self.store(-value, d, EXACT, move)
+    else:
+      self.store(value, d, EXACT, move)
+    x, y = board.coords(move)
+    self.depth_evals[1] += 1
+    return (value, x, y)
+
+  def use_tt(self, algo):
+    # Negamax stores values from the side to move's point of view (and wins
+    # by their distance), minimax and alphabeta from O's. An entry of the
+    # other kind would be read with the wrong sign, so the table is cleared
+    # when the search changes kind.
+    tt = self.tt
+    if tt is None or algo == self.MCTS:
+      return
+    view = 'negamax' if algo == self.NEGAMAX else 'O'
+    if tt.view is not None and tt.view != view:
+      tt.clear()
+    tt.view = view
+
+  def search(self, algo, max, d, start, limit):
+    self.use_tt(algo)
+    if self.workers:
+      search = functools.partial(self.split, algo)
+    elif algo == self.MINIMAX:
+      search = self.minimax
+    elif algo == self.NEGAMAX:
+      search = self.pvs
+    else:  # algo == self.ALPHABETA
+      search = self.alphabeta
+    self.depth_evals = Counter({i: 0 for i in range(1, self.max_depth + 1)})
+    self.truncated = False
+    self.timed_out = False
+    self.e1_invocations = 0
+    self.e2_invocations = 0
+    self.root_pv = None
+    self.root_score = None
+    self.researches = 0
+    self.nodes = 0
+    self.interior = 0
+    self.cutoffs = 0
+    self.next_check = 0
+    self.elapsed = 0
+    if self.ordering is not None:
+      self.ordering.new_search()
+    self.solved_hit = False
+    if self.solved:
+      best = self.lookup()
+      if best is not None:
+        self.solved_hit = True
+        self.depth_reached = d
+        return best
+    self.mcts_stats = None
+    if algo == self.MCTS:
+      return self.mcts(max, start, limit)
+    if not self.deepening:
+      self.depth_reached = d
+      self.root_depth = d
+      return search(max=max, d=d, start=start, limit=limit)
+    # Iterative deepening: keep the move of the last depth that finished
+    # and abandon the one that runs into the time limit
+    history = len(self.board.history)
+    best = None
+    for depth in range(0, d + 1):
+      self.root_depth = depth
+      try:
+        best = search(max=max, d=depth, start=start, limit=limit)
+      except SearchTimeout:
+        self.board.rewind(history)
+        self.truncated = True
+        break
+      self.depth_reached = depth
+      if best[1] is not None:
+        self.root_pv = self.board.index(best[1], best[2])
+      if (self.on_iteration is not None and
+          self.on_iteration(self, depth, best, time.time() - start)):
+        # The hook (a game clock) cut the search short of depth d
+        if depth < d:
+          self.truncated = True
+        break
+    if best is None:
+      # Not even depth 0 finished: play the best move by the static
+      # evaluation of the children, which takes no search at all
+      self.depth_reached = 0
+      (value, move) = self.horizon(max)
+      if move is None:
+        return (value, None, None)
+      x, y = self.board.coords(move)
+      best = (value, x, y)
+    return best
+
+  def move_record(self, value, x, y, elapsed, invocations, tt):
+    # Statistics of the search that just finished, for the trace and the
+    # telemetry sink
+    evals = sum(self.depth_evals.values())
+    record = {
+        'move': len(self.records) + 1,
+        'player': self.player_turn,
+        'row': x,
+        'column': y,
+        'value': value,
+        'time': elapsed,
+        'depth': self.depth_reached,
+        'deepening': self.deepening,
+        'nodes': self.nodes,
+        'interior': self.interior,
+        'evals': self.invocations - invocations,
+        'cutoffs': self.cutoffs,
+        'researches': self.researches,
+        'timed_out': self.timed_out,
+        # Whether the time (or node) limit cut the search short, which makes
+        # the move depend on the machine's speed
+        'truncated': self.truncated,
+        'branching':
+            (self.nodes - 1) / self.interior if self.interior else 0.0,
+        # The b with b ** depth == nodes, comparable between depths
+        'effective_branching':
+            self.nodes**(1 / self.depth_reached)
+            if self.depth_reached else 0.0,
+        'depth_evals': dict(self.depth_evals),
+        'avg_depth':
+            sum(k * v for k, v in self.depth_evals.items()) / evals
+            if evals else 0.0,
+    }
+    if tt is not None:
+      stats = self.tt.stats()
+      hits = stats['hits'] - tt['hits']
+      misses = stats['misses'] - tt['misses']
+      record['tt'] = {
+          'hits': hits,
+          'misses': misses,
+          'collisions': stats['collisions'] - tt['collisions'],
+          'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+      }
+    if self.ordering is not None:
+      record['ordering'] = self.ordering.stats()
+    if self.radius:
+      record['radius'] = self.radius
+    if self.solved:
+      record['solved'] = self.solved_hit
+    if self.mcts_stats is not None:
+      record['mcts'] = self.mcts_stats
+    return record
+
+  def think(self, limits=None):
+    # Search the current position for the side to move and return the move
+    # record. limits may override the depth, the time limit (None for
+    # none), the node budget and the algorithm for this search only.
+    limits = limits or {}
+    algo = limits.get('algo', self.ALPHABETA)
+    if self.player_turn == 'X':
+      d = limits.get('depth', self.depth1)
+    else:
+      d = limits.get('depth', self.depth2)
+    limit = limits.get('time', self.time_limit)
+    if limit is None:
+      limit = float('inf')
+    saved = (self.node_budget, self.deepening, self.margin)
+    if limits.get('nodes') is not None:
+      self.node_budget = limits['nodes']
+      self.deepening = True
+      self.margin = 0
+    start = time.time()
+    invocations = self.invocations
+    tt = self.tt.stats() if self.tt is not None else None
+    if self.telemetry is not None:
+      self.telemetry.begin(self)
+    record = None
+    try:
+      try:
+        (m, x, y) = self.search(algo,
+                                max=self.player_turn == 'O',
+                                d=d,
+                                start=start,
+                                limit=limit)
+      finally:
+        (self.node_budget, self.deepening, self.margin) = saved
+      end = time.time()
+      record = self.move_record(m, x, y, end - start, invocations, tt)
+    finally:
+      # The timing wrappers come off even when the search fails
+      if self.telemetry is not None:
+        self.telemetry.end(self, record)
+    return record
+
+  def load(self, position, side=None):
+    # Set up a position, given as a Board or as rows of '.XO*' read with
+    # this engine's s. The side to move defaults to the one with fewer
+    # stones (X on a tie, as X moves first).
+    if not isinstance(position, Board):
+      position = from_rows(position, self.s)
+    board = self.board
+    if (position.n, position.s, position.blocks) != (board.n, board.s,
+                                                     board.blocks):
+      # Another board: searchers built for the old one are of no use
+      self.n = position.n
+      self.s = position.s
+      self.blocks = []
+      self.add_blocks(position.coords(idx) for idx in bits(position.blocks))
+      if self.tt is not None:
+        self.tt.clear()
+      self.tree = None
+      self.close()
+      self.config.update(n=self.n, s=self.s, blocks=self.blocks)
+    else:
+      board.rewind(0)
+    board = self.board
+    for idx in position.history:
+      board.play(idx, 'X' if position.x >> idx & 1 else 'O')
+    if side is None:
+      side = 'O' if popcount(board.x) > popcount(board.o) else 'X'
+    self.player_turn = side
+
+  def best_move(self, position, side=None, limits=None):
+    # Headless search: the move record (row, column, value and search
+    # statistics) of the best move for side in position
+    self.load(position, side)
+    record = self.think(limits)
+    if self.telemetry is not None:
+      self.telemetry.emit(record)
+    return record
+
+  def e1(self):
+    self.invocations += 1
+    self.e1_invocations += 1
+    return self.board.e1()
+
+  def e2(self):
+    self.invocations += 1
+    self.e2_invocations += 1
+    return self.board.e2()
+
+  def add_blocks(self, b):
+    self.blocks = self.blocks + list(b)
+    self.board = self.new_board()
+    self.evaluator = None
+
+
+def best_move(position, side=None, limits=None, **options):
+  # One-off search with an engine built from options (the Engine arguments)
+  engine = Engine(**options)
+  try:
+    return engine.best_move(position, side, limits)
+  finally:
+    engine.close()
+
+
+def cached_engine(engines, key, size, **options):
+  # The Engine for key in engines, a dict kept as a cache of at most size
+  # engines, built from options when missing; the least recently used one
+  # is closed and dropped to make room
+  engine = engines.pop(key, None)
+  if engine is None:
+    if len(engines) >= size:
+      engines.pop(next(iter(engines))).close()
+    engine = Engine(**options)
+  engines[key] = engine
+  return engine
+
+
+class Ponder:
+  # Searches the replies to the moves a human is likely to play while the
+  # human is choosing, on a thread with its own Engine that shares the
+  # transposition table of the game engine. When the move played was
+  # pondered, the reply search finds its result in the table.
+
+  def __init__(self, engine):
+    config = dict(engine.config, workers=None, deepening=True, nodes=None)
+    self.engine = Engine(**config)
+    self.engine.tt = engine.tt
+    self.engine.stop = threading.Event()
+    self.thread = None
+    self.done = []
+
+  def start(self, board, player, moves, limits):
+    # Search the position after each of player's moves (most likely first)
+    # for the other side, until stopped
+    self.engine.stop.clear()
+    self.done = []
+    self.thread = threading.Thread(target=self.run,
+                                   args=(list(board.history), board.x,
+                                         player, list(moves), limits),
+                                   daemon=True)
+    self.thread.start()
+
+  def run(self, history, x, player, moves, limits):
+    engine = self.engine
+    board = engine.board
+    for idx in moves:
+      board.rewind(0)
+      for k in history:
+        board.play(k, 'X' if x >> k & 1 else 'O')
+      board.play(idx, player)
+      engine.player_turn = 'O' if player == 'X' else 'X'
+      engine.search(limits.get('algo', Engine.ALPHABETA),
+                    max=player == 'X',
+                    d=limits['depth'],
+                    start=time.time(),
+                    limit=float('inf'))
+      if engine.stop.is_set():
+        break
+      self.done.append(idx)
+
+  def stop(self):
+    # Stop searching and return the moves whose reply search finished
+    if self.thread is not None:
+      self.engine.stop.set()
+      self.thread.join()
+      self.thread = None
+    return self.done
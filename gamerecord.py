@@ -0,0 +1,292 @@
+# Compact binary game records.
+#
+# A record file is a stream of games, each a fixed header followed by its
+# blocks (one byte per cell, i * n + j) and its moves (the cell and the
+# search statistics of the move). A gameTrace file of up to 19KB becomes a
+# record of a few hundred bytes, and read_records streams them one game at
+# a time, so a file of millions of games is read at constant memory.
+#
+#   python gamerecord.py import gameTrace-*.txt -o games.rec
+#   python gamerecord.py analyse games.rec --depth 4 --workers 8
+#
+# analyse replays every game through the engine across a process pool:
+# with --static it scores each position with e1 and e2, otherwise it
+# searches each position and reports the moves that threw away a win or a
+# draw (or, with --margin, lost at least that much score).
+
+import sys
+import json
+import math
+import struct
+import argparse
+import itertools
+import multiprocessing
+
+from bitboard import Board, WIN
+from engine import MATE, cached_engine
+from gametrace import read_trace
+
+MAGIC = b'GR'
+VERSION = 1
+# Magic, version, n, s, blocks, the Engine's depth1, depth2, e1 and e2,
+# algo, winner, t (NaN for none) and the number of moves
+HEADER = struct.Struct('<2sBBBBBBBBBBfH')
+# Cell, time, heuristic evaluations, average evaluation depth, depth
+# reached and value of a move; NaN (or 0 for the depth) where unknown
+MOVE = struct.Struct('<BfIfBd')
+WINNERS = (None, 'X', 'O', '.')
+
+
+def _number(value):
+  return float('nan') if value is None else value
+
+
+def _known(value):
+  return None if math.isnan(value) else value
+
+
+def encode(game):
+  # The record of a game, a dict like read_records yields
+  n = game['n']
+  if n * n > 256:
+    raise ValueError(f'n={n} is too large for a game record')
+  moves = game['moves']
+  parts = [
+      HEADER.pack(MAGIC, VERSION, n, game['s'], len(game['blocks']),
+                  game['d1'], game['d2'], game['e1'], game['e2'],
+                  int(game['algo']), WINNERS.index(game['winner']),
+                  _number(game['t']), len(moves)),
+      bytes(i * n + j for (i, j) in game['blocks']),
+  ]
+  for move in moves:
+    parts.append(
+        MOVE.pack(move['row'] * n + move['column'],
+                  _number(move.get('time')), move.get('evals', 0),
+                  _number(move.get('avg_depth')), move.get('depth', 0),
+                  _number(move.get('value'))))
+  return b''.join(parts)
+
+
+def parse_records(f):
+  # Generator of the games of a binary stream, each a dict with the header
+  # (n, s, blocks, d1, d2, e1, e2, algo, winner, t) and the moves with their
+  # statistics
+  while True:
+    header = f.read(HEADER.size)
+    if not header:
+      return
+    if len(header) < HEADER.size:
+      raise ValueError('game record cut short')
+    (magic, version, n, s, b, d1, d2, e1, e2, algo, winner, t,
+     count) = HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION:
+      raise ValueError('not a game record')
+    body = f.read(b + count * MOVE.size)
+    if len(body) < b + count * MOVE.size:
+      raise ValueError('game record cut short')
+    moves = []
+    player = 'X'
+    for (idx, time, evals, avg_depth, depth,
+         value) in MOVE.iter_unpack(body[b:]):
+      moves.append({
+          'player': player,
+          'row': idx // n,
+          'column': idx % n,
+          'time': _known(time),
+          'evals': evals,
+          'avg_depth': _known(avg_depth),
+          'depth': depth,
+          'value': _known(value),
+      })
+      player = 'O' if player == 'X' else 'X'
+    yield {
+        'n': n,
+        's': s,
+        'blocks': [divmod(idx, n) for idx in body[:b]],
+        'd1': d1,
+        'd2': d2,
+        'e1': e1,
+        'e2': e2,
+        'algo': algo,
+        'winner': WINNERS[winner],
+        't': _known(t),
+        'moves': moves,
+    }
+
+
+def read_records(path):
+  with open(path, 'rb') as f:
+    yield from parse_records(f)
+
+
+def from_trace(trace):
+  # The game of a trace read by gametrace.read_trace
+  players = trace['players'] or [{'d': 0, 'a': True, 'e': 'e1'},
+                                 {'d': 0, 'a': True, 'e': 'e2'}]
+  return {
+      'n': trace['n'],
+      's': trace['s'],
+      'blocks': trace['blocks'],
+      'd1': players[0]['d'],
+      'd2': players[-1]['d'],
+      'e1': int(players[0]['e'][1:]),
+      'e2': int(players[-1]['e'][1:]),
+      'algo': players[0]['a'],
+      'winner': trace['winner'],
+      't': trace['t'],
+      'moves': trace['moves'],
+  }
+
+
+def from_game(game, algo, winner):
+  # The game a Game has just played, from its move records
+  (e1, e2) = game.heuristics
+  return {
+      'n': game.n,
+      's': game.s,
+      'blocks': game.blocks,
+      'd1': game.depth1,
+      'd2': game.depth2,
+      'e1': e1,
+      'e2': e2,
+      'algo': algo,
+      'winner': winner,
+      't': game.time_limit,
+      'moves': game.records,
+  }
+
+
+# Engines a worker keeps, one per board, heuristics and option set, the
+# least recently used dropped first
+CACHE = 16
+_engines = {}
+
+
+def _engine(game, options):
+  key = json.dumps(
+      [game['n'], game['s'], game['blocks'], game['e1'], game['e2'], options])
+  return cached_engine(_engines,
+                       key,
+                       CACHE,
+                       n=game['n'],
+                       s=game['s'],
+                       blocks=[tuple(block) for block in game['blocks']],
+                       e1=game['e1'],
+                       e2=game['e2'],
+                       t=None,
+                       **options)
+
+
+def _outcome(value):
+  # 1 for a win for O, -1 for a win for X and 0 for anything else
+  return (value >= MATE) - (value <= -MATE)
+
+
+def analyse(task):
+  # Replay one game: the e1 and e2 scores after every move, or the moves
+  # the search at depth finds that lost a win or a draw (or margin score)
+  (number, game, depth, static, margin, options) = task
+  engine = _engine(game, options)
+  board = Board(game['n'], game['s'], [tuple(b) for b in game['blocks']])
+  scores = []
+  blunders = []
+  for (ply, move) in enumerate(game['moves']):
+    player = move['player']
+    idx = board.index(move['row'], move['column'])
+    if static:
+      board.play(idx, player)
+      scores.append((board.e1(), board.e2()))
+      continue
+    engine.load(board, player)
+    best = engine.think({'algo': game['algo'], 'depth': depth})
+    board.play(idx, player)
+    result = board.result()
+    if result is not None:
+      played = {'X': -WIN, 'O': WIN, '.': 0}[result]
+    else:
+      engine.load(board, 'O' if player == 'X' else 'X')
+      played = engine.think({
+          'algo': game['algo'],
+          'depth': max(depth - 1, 0)
+      })['value']
+    sign = 1 if player == 'O' else -1
+    loss = sign * (best['value'] - played)
+    if (sign * _outcome(played) < sign * _outcome(best['value']) or
+        margin is not None and loss >= margin):
+      blunders.append({
+          'ply': ply,
+          'player': player,
+          'row': move['row'],
+          'column': move['column'],
+          'best_row': best['row'],
+          'best_column': best['column'],
+          'best': best['value'],
+          'played': played,
+      })
+  if static:
+    return {'game': number, 'scores': scores}
+  return {'game': number, 'blunders': blunders}
+
+
+def analyse_all(paths, depth, static=False, margin=None, options=None,
+                workers=None, chunk=64):
+  # Generator of the analyses of every game in the record files, in order.
+  # Games are handed to the pool a batch at a time, so only a batch of
+  # games is in memory however large the files are.
+  games = itertools.chain.from_iterable(read_records(path) for path in paths)
+  tasks = ((number, game, depth, static, margin, options or {})
+           for number, game in enumerate(games))
+  if workers == 1:
+    yield from map(analyse, tasks)
+    return
+  with multiprocessing.Pool(workers) as pool:
+    size = chunk * (workers or multiprocessing.cpu_count())
+    while True:
+      batch = list(itertools.islice(tasks, size))
+      if not batch:
+        return
+      yield from pool.imap(analyse, batch, chunksize=4)
+
+
+def main():
+  parser = argparse.ArgumentParser(description='binary game records')
+  commands = parser.add_subparsers(dest='command', required=True)
+  imports = commands.add_parser('import', help='convert gameTrace files')
+  imports.add_argument('traces', nargs='+')
+  imports.add_argument('-o', '--output', required=True,
+                       help='record file, appended to')
+  analysis = commands.add_parser('analyse', help='replay and re-score games')
+  analysis.add_argument('records', nargs='+')
+  analysis.add_argument('-d', '--depth', type=int, default=4)
+  analysis.add_argument('--static', action='store_true',
+                        help='score positions with e1 and e2, no search')
+  analysis.add_argument('--margin', type=float,
+                        help='also report moves losing this much score')
+  analysis.add_argument('--options', default='{}',
+                        help='extra Engine arguments as JSON')
+  analysis.add_argument('--workers', type=int)
+  analysis.add_argument('-o', '--output', help='JSON lines file')
+  args = parser.parse_args()
+  if args.command == 'import':
+    with open(args.output, 'ab') as f:
+      for path in args.traces:
+        f.write(encode(from_trace(read_trace(path))))
+    return
+  out = open(args.output, 'w') if args.output else sys.stdout
+  games = blunders = 0
+  try:
+    for analysis in analyse_all(args.records, args.depth, args.static,
+                                args.margin, json.loads(args.options),
+                                args.workers):
+      out.write(json.dumps(analysis) + '\n')
+      games += 1
+      blunders += len(analysis.get('blunders', ()))
+  finally:
+    if out is not sys.stdout:
+      out.close()
+  print(f'{games} games' +
+        ('' if args.static else f', {blunders} blunders'), file=sys.stderr)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,102 @@
+# Reader for the gameTrace-*.txt files written by Game.play.
+#
+# Understands both the format written by draw_board (bare rows of '.XO*'
+# and "plays: row:r, column:c") and the labelled format of the sample
+# trace (rows prefixed with "r|" and moves written as "C2").
+
+import re
+
+HEADER = re.compile(r'n=(\d+) b=(\d+) s=(\d+) t=(\d+)')
+PLAYER = re.compile(r'Player (\d): (\w+) d=(\d+) a=(\w+),? (e\d)')
+MOVE = re.compile(
+    r'Player ([XO]) under AI control plays: (?:row:(\d+), column:(\d+)|([A-Z])(\d+))'
+)
+ROW = re.compile(r'^(?:\s*\d+\|)?([.XO*]+)\s*$')
+STAT = re.compile(r'^(i|ii|iii|iv|v)\s+([^:]+): (.*)$')
+WINNER = re.compile(r"The winner is ([XO.])|It's a tie")
+
+
+def read_trace(path):
+  with open(path) as f:
+    return parse_trace(f)
+
+
+def parse_trace(lines):
+  # Returns a dict with the header (n, b, s, t, players), the blocks, every
+  # board drawn (as lists of row strings), the moves with their per-move
+  # statistics and the winner ('.' for a tie, None if the game is cut off)
+  trace = {
+      'n': None,
+      'b': None,
+      's': None,
+      't': None,
+      'blocks': [],
+      'players': [],
+      'boards': [],
+      'moves': [],
+      'winner': None,
+  }
+  rows = []
+  for line in lines:
+    line = line.rstrip('\n')
+    match = HEADER.match(line)
+    if match and trace['n'] is None:
+      (trace['n'], trace['b'], trace['s'],
+       trace['t']) = (int(g) for g in match.groups())
+      continue
+    match = PLAYER.match(line)
+    if match:
+      trace['players'].append({
+          'player': int(match.group(1)),
+          'd': int(match.group(3)),
+          'a': match.group(4) == 'True',
+          'e': match.group(5),
+      })
+      continue
+    match = ROW.match(line)
+    if match and trace['n'] and len(match.group(1)) == trace['n']:
+      rows.append(match.group(1))
+      if len(rows) == trace['n']:
+        trace['boards'].append(rows)
+        rows = []
+      continue
+    rows = []
+    match = MOVE.match(line)
+    if match:
+      (player, row, column, letter, number) = match.groups()
+      if letter:
+        row, column = number, ord(letter) - ord('A')
+      trace['moves'].append({
+          'player': player,
+          'row': int(row),
+          'column': int(column),
+      })
+      continue
+    match = STAT.match(line.strip())
+    if match and trace['moves']:
+      trace['moves'][-1].update(_stat(match.group(2), match.group(3)))
+      continue
+    match = WINNER.match(line)
+    if match:
+      trace['winner'] = match.group(1) or '.'
+  if trace['boards']:
+    first = trace['boards'][0]
+    trace['blocks'] = [(i, j)
+                       for i, row in enumerate(first)
+                       for j, cell in enumerate(row)
+                       if cell == '*']
+  return trace
+
+
+def _stat(name, value):
+  name = name.strip()
+  if name == 'Evaluation time':
+    return {'time': float(value.rstrip('s'))}
+  elif name == 'Heuristic evaluations':
+    return {'evals': int(value)}
+  elif name == 'Evaluations by depth':
+    pairs = re.findall(r'(\d+): (\d+)', value)
+    return {'depth_evals': {int(k): int(v) for k, v in pairs}}
+  elif name == 'Average evaluation depth':
+    return {'avg_depth': float(value)}
+  return {}
@@ -0,0 +1,64 @@
+# Batched evaluation of the children of a node at the depth limit.
+#
+# Instead of playing, scoring and undoing every empty cell, the e1 and e2
+# value of every child is computed at once: a window-by-cell membership
+# matrix turns the per-window change caused by a stone into a per-cell
+# change with one matrix-vector product. Needs NumPy; Game falls back to
+# its Python loop when it is not installed.
+
+try:
+  import numpy as np
+except ImportError:
+  np = None
+
+from bitboard import WIN
+
+# Below this many children the Python loop is as fast as the NumPy setup
+BATCH_MIN = 12
+
+
+class BatchEvaluator:
+
+  def __init__(self, board):
+    cells = board.stride * board.n
+    self.s = board.s
+    self.membership = np.zeros((len(board.windows), cells), dtype=np.int64)
+    for idx, windows in board.through.items():
+      for w in windows:
+        self.membership[w, idx] = 1
+    self.weights = np.zeros(cells)
+    for idx, weight in board.weights.items():
+      self.weights[idx] = weight
+
+  def e1(self, board, player):
+    # e1 of every child, indexed by cell
+    xcount = np.array(board.xcount, dtype=np.int64)
+    ocount = np.array(board.ocount, dtype=np.int64)
+    if player == 'X':
+      own, other, sign = xcount, ocount, -1
+    else:
+      own, other, sign = ocount, xcount, 1
+    # A window free of the other side gains one stone of ours; a window
+    # that only held the other side's stones stops counting for them
+    delta = np.where(other == 0, sign, np.where(own == 0, sign * other, 0))
+    wins = (own == self.s - 1) & (other == 0)
+    values = board.score + delta @ self.membership
+    values[wins.astype(np.int64) @ self.membership > 0] = sign * WIN
+    return values
+
+  def e2(self, board, player):
+    sign = -1 if player == 'X' else 1
+    return board.e2() + sign * self.weights
+
+  def best(self, board, max, heuristic):
+    # (value, move, children) of the best child for the side to move, the
+    # first in row-major order on ties like the Python loop
+    player = 'O' if max else 'X'
+    if heuristic == 1:
+      values = self.e1(board, player)
+    else:
+      values = self.e2(board, player)
+    free = np.fromiter(board.candidates(), dtype=np.intp)
+    values = values[free]
+    k = int(values.argmax() if max else values.argmin())
+    return (values[k].item(), int(free[k]), len(free))
@@ -0,0 +1,183 @@
+# Monte Carlo tree search (UCT) for boards too large to search to depth.
+#
+# The tree is kept in parallel arrays indexed by node number instead of one
+# object per node: the children of a node are a contiguous run starting at
+# first[node]. Each iteration walks down the tree by UCB1, expands the leaf
+# it reaches, plays the game out (at random, or taking wins and blocking
+# threats first) and credits the result to every node on the path. The tree
+# stops growing at max_nodes nodes (its leaves are then played out without
+# being expanded) and is kept between moves and re-rooted at the position
+# reached, as long as it is not full.
+
+import math
+import random
+from array import array
+
+from bitboard import bits
+
+PLAYOUTS = ('random', 'heuristic')
+
+
+class MCTS:
+
+  def __init__(self, c=1.4, playout='random', max_nodes=1 << 20, seed=None):
+    if playout not in PLAYOUTS:
+      raise ValueError(f'playout must be one of {PLAYOUTS}')
+    self.c = c
+    self.playout = playout
+    self.max_nodes = max_nodes
+    self.rng = random.Random(seed)
+    self.reset()
+
+  def reset(self):
+    self.move = array('i', [-1])
+    self.first = array('i', [-1])
+    self.count = array('i', [0])
+    self.visits = array('l', [0])
+    # Results from the point of view of the side that played into the node
+    self.wins = array('d', [0.0])
+    self.root = 0
+    self.history = ()
+
+  def size(self):
+    return len(self.move)
+
+  def nbytes(self):
+    return sum(a.itemsize * len(a) for a in (self.move, self.first, self.count,
+                                             self.visits, self.wins))
+
+  def reroot(self, board):
+    # Make the node of the current position the root, following the moves
+    # played since the last search; start afresh when it is not in the tree
+    history = tuple(board.history)
+    old = self.history
+    node = self.root
+    if history[:len(old)] == old and self.size() < self.max_nodes:
+      for idx in history[len(old):]:
+        first = self.first[node]
+        child = -1
+        for c in range(first, first + self.count[node]):
+          if self.move[c] == idx:
+            child = c
+            break
+        if child < 0:
+          node = -1
+          break
+        node = child
+    else:
+      node = -1
+    if node < 0:
+      self.reset()
+    else:
+      self.root = node
+    self.history = history
+
+  def expand(self, node, board):
+    # Add the children of node; False when they do not fit in max_nodes
+    # (the root is always expanded, to have moves to choose from)
+    moves = list(board.candidates())
+    if node != self.root and len(self.move) + len(moves) > self.max_nodes:
+      return False
+    self.rng.shuffle(moves)
+    self.first[node] = len(self.move)
+    self.count[node] = len(moves)
+    self.move.extend(moves)
+    k = len(moves)
+    self.first.extend([-1] * k)
+    self.count.extend([0] * k)
+    self.visits.extend([0] * k)
+    self.wins.extend([0.0] * k)
+    return True
+
+  def select(self, node):
+    # UCB1 child of node, an unvisited one first
+    visits = self.visits
+    wins = self.wins
+    c = self.c * math.sqrt(math.log(visits[node] or 1))
+    best = -1
+    score = float('-inf')
+    first = self.first[node]
+    for child in range(first, first + self.count[node]):
+      v = visits[child]
+      if not v:
+        return child
+      s = wins[child] / v + c / math.sqrt(v)
+      if s > score:
+        score = s
+        best = child
+    return best
+
+  def rollout(self, board, player):
+    # Play the game out from board with player to move; returns the result
+    # ('X', 'O' or '.') with the board restored
+    cells = list(bits(board.free))
+    self.rng.shuffle(cells)
+    heuristic = self.playout == 'heuristic'
+    played = []
+    result = board.result()
+    k = 0
+    while result is None:
+      idx = None
+      if heuristic:
+        own = board.xthreats if player == 'X' else board.othreats
+        other = board.othreats if player == 'X' else board.xthreats
+        if own:
+          idx = next(iter(own))
+        elif other:
+          idx = next(iter(other))
+      if idx is None:
+        while not board.free >> cells[k] & 1:
+          k += 1
+        idx = cells[k]
+      board.play(idx, player)
+      played.append((idx, player))
+      player = 'O' if player == 'X' else 'X'
+      result = board.result()
+    for (idx, p) in reversed(played):
+      board.undo(idx, p)
+    return result
+
+  def iterate(self, board, player):
+    # One iteration from the root; returns the depth of the leaf reached
+    node = self.root
+    path = [node]
+    played = []
+    while self.count[node]:
+      node = self.select(node)
+      board.play(self.move[node], player)
+      played.append((self.move[node], player))
+      player = 'O' if player == 'X' else 'X'
+      path.append(node)
+    result = board.result()
+    if (result is None and (self.visits[node] or node == self.root) and
+        self.expand(node, board)):
+      node = self.select(node)
+      board.play(self.move[node], player)
+      played.append((self.move[node], player))
+      player = 'O' if player == 'X' else 'X'
+      path.append(node)
+      result = board.result()
+    if result is None:
+      result = self.rollout(board, player)
+    for (idx, p) in reversed(played):
+      board.undo(idx, p)
+    # The node at the end of the path was entered by the side before player
+    mover = 'O' if player == 'X' else 'X'
+    visits = self.visits
+    wins = self.wins
+    for node in reversed(path):
+      visits[node] += 1
+      if result == mover:
+        wins[node] += 1
+      elif result == '.':
+        wins[node] += 0.5
+      mover = 'O' if mover == 'X' else 'X'
+    return len(path) - 1
+
+  def children(self):
+    # {move: (visits, wins)} of the root, wins for the side to move
+    first = self.first[self.root]
+    return {
+        self.move[c]: (self.visits[c], self.wins[c])
+        for c in range(first, first + self.count[self.root])
+    }
@@ -0,0 +1,91 @@
+# Move ordering for alphabeta.
+#
+# Game asks its ordering for the children of every interior node and
+# reports back which move (and at which position in the list) caused a
+# cutoff. MoveOrdering keeps the plain row-major order and only collects
+# statistics; HeuristicOrdering tries the principal-variation move first,
+# then the killer moves of the ply, then the remaining cells ranked by the
+# history table and a cheap static score.
+
+from bitboard import neighbourhoods, popcount
+
+
+class MoveOrdering:
+
+  def __init__(self):
+    self.clear_stats()
+
+  def clear_stats(self):
+    self.nodes = 0
+    self.cutoffs = 0
+    self.first_cutoffs = 0
+
+  def new_search(self):
+    self.clear_stats()
+
+  def order(self, board, ply, max, pv=None):
+    self.nodes += 1
+    return board.candidates()
+
+  def cutoff(self, move, ply, max, remaining, index):
+    self.cutoffs += 1
+    if index == 0:
+      self.first_cutoffs += 1
+
+  def stats(self):
+    return {
+        'nodes': self.nodes,
+        'cutoffs': self.cutoffs,
+        'first_cutoffs': self.first_cutoffs,
+        'first_cutoff_rate':
+            self.first_cutoffs / self.cutoffs if self.cutoffs else 0.0,
+    }
+
+
+class HeuristicOrdering(MoveOrdering):
+
+  def __init__(self, killers=2, nearness=2):
+    super().__init__()
+    self.slots = killers
+    self.nearness = nearness
+    self.killers = {}
+    # One history table for each side, indexed by the max flag
+    self.history = ({}, {})
+
+  def new_search(self):
+    # Killers are per ply, which shifts by one every move; history is
+    # kept but aged so that old cutoffs slowly lose weight
+    super().new_search()
+    self.killers = {}
+    for table in self.history:
+      for idx in table:
+        table[idx] //= 2
+
+  def order(self, board, ply, max, pv=None):
+    self.nodes += 1
+    occupied = board.x | board.o
+    near = neighbourhoods(board.n)
+    weights = board.weights
+    history = self.history[max]
+    nearness = self.nearness
+    moves = sorted(board.candidates(),
+                   key=lambda idx: -(history.get(idx, 0) + nearness * popcount(
+                       near[idx] & occupied) + weights[idx]))
+    first = []
+    if pv is not None and board.free >> pv & 1:
+      first.append(pv)
+    for killer in self.killers.get(ply, ()):
+      if killer != pv and board.free >> killer & 1:
+        first.append(killer)
+    if first:
+      moves = first + [idx for idx in moves if idx not in first]
+    return moves
+
+  def cutoff(self, move, ply, max, remaining, index):
+    super().cutoff(move, ply, max, remaining, index)
+    killers = self.killers.setdefault(ply, [])
+    if move not in killers:
+      killers.insert(0, move)
+      del killers[self.slots:]
+    history = self.history[max]
+    history[move] = history.get(move, 0) + remaining * remaining
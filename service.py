@@ -0,0 +1,325 @@
+# Best-move service for frontends that run many games at once.
+#
+# A local asyncio server (TCP or Unix socket) reads requests as JSON lines:
+#
+#   {"id": 7, "n": 4, "s": 3, "blocks": [[0, 0]], "board": ["*...", ...],
+#    "side": "X", "limits": {"depth": 4, "time": 1.0}, "options": {...},
+#    "deadline": 2.0}
+#
+# and answers each with a line holding its id and the move record, or its id
+# and an error (a "bad request" one, without queueing it, when a field is
+# missing or malformed). The searches run in a pool of worker processes that
+# live as long as the server and keep an Engine (its transposition table and
+# precomputed windows) for each board and option set they have served.
+# Requests wait in a bounded queue; while it is full the server stops reading
+# from the connection, so clients that send too much are slowed down rather
+# than buffered. A request still queued at its deadline is answered with an
+# error, and one that gets a worker searches at most until its deadline; a
+# search that overruns it is answered with an error at the deadline, but its
+# worker takes no other request until the search is done.
+#
+#   python service.py serve --port 7878 --workers 4
+#   python service.py load --port 7878 --connections 16 --requests 1000
+
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from bitboard import Board
+from engine import cached_engine
+
+# Engines a worker keeps, the least recently used dropped first
+CACHE = 16
+_engines = {}
+# Share of the time left before a request's deadline kept for the reply
+SLACK = 0.2
+
+
+def _engine(request):
+  options = dict(request.get('options') or {})
+  # Requests are searched in parallel already
+  options.pop('workers', None)
+  # Iterative deepening has a move ready whenever the deadline comes
+  options.setdefault('deepening', True)
+  blocks = [tuple(block) for block in request.get('blocks') or []]
+  key = json.dumps([request['n'], request['s'], blocks, options],
+                   sort_keys=True)
+  return cached_engine(_engines,
+                       key,
+                       CACHE,
+                       n=request['n'],
+                       s=request['s'],
+                       blocks=blocks,
+                       **options)
+
+
+def _count(value):
+  return isinstance(value, int) and not isinstance(value, bool) and value > 0
+
+
+def validate(request):
+  # Raise a ValueError naming the first field of the request that is
+  # missing or malformed
+  if not isinstance(request, dict):
+    raise ValueError('a request is a JSON object')
+  n = request.get('n')
+  if not _count(n):
+    raise ValueError('n must be a positive integer')
+  s = request.get('s')
+  if not _count(s) or s > n:
+    raise ValueError(f's must be an integer from 1 to {n}')
+  board = request.get('board')
+  if (not isinstance(board, list) or len(board) != n or
+      any(not isinstance(row, str) or len(row) != n for row in board)):
+    raise ValueError(f'board must be {n} rows of {n} cells')
+  if any(c not in '.XO*' for row in board for c in row):
+    raise ValueError("board cells must be '.', 'X', 'O' or '*'")
+  blocks = request.get('blocks') or []
+  if not isinstance(blocks, list) or any(
+      not isinstance(block, list) or len(block) != 2 or
+      not all(isinstance(k, int) and 0 <= k < n for k in block)
+      for block in blocks):
+    raise ValueError('blocks must be [row, column] cells of the board')
+  if request.get('side') not in (None, 'X', 'O'):
+    raise ValueError("side must be 'X' or 'O'")
+  limits = request.get('limits')
+  if limits is not None and not isinstance(limits, dict):
+    raise ValueError('limits must be an object')
+  options = request.get('options')
+  if options is not None and not isinstance(options, dict):
+    raise ValueError('options must be an object')
+  deadline = request.get('deadline')
+  if deadline is not None and (isinstance(deadline, bool) or
+                               not isinstance(deadline, (int, float))):
+    raise ValueError('deadline must be a number of seconds')
+
+
+def search(request, limits):
+  # Runs in a worker: the move record of the request's position, which
+  # validate has checked
+  engine = _engine(request)
+  rows = [list(row) for row in request['board']]
+  for (i, j) in request.get('blocks') or []:
+    rows[i][j] = '*'
+  engine.load([''.join(row) for row in rows], request.get('side'))
+  if engine.board.result() is not None:
+    raise ValueError('the game is over')
+  return engine.think(limits)
+
+
+class Service:
+
+  def __init__(self, workers=None, queue=64, deadline=30.0):
+    self.pool = ProcessPoolExecutor(workers)
+    self.workers = workers or os.cpu_count() or 1
+    self.size = queue
+    self.deadline = deadline
+    self.queue = None
+    self.dispatchers = []
+
+  async def start(self, host='127.0.0.1', port=7878, path=None):
+    self.queue = asyncio.Queue(self.size)
+    # One dispatcher per worker keeps every worker busy and no more requests
+    # than that out of the queue
+    self.dispatchers = [
+        asyncio.create_task(self.dispatch()) for _ in range(0, self.workers)
+    ]
+    if path is not None:
+      return await asyncio.start_unix_server(self.handle, path)
+    return await asyncio.start_server(self.handle, host, port)
+
+  def close(self):
+    for task in self.dispatchers:
+      task.cancel()
+    self.pool.shutdown(cancel_futures=True)
+
+  async def handle(self, reader, writer):
+    # One connection: its requests are read in order and answered as they
+    # finish
+    loop = asyncio.get_running_loop()
+    replies = set()
+    try:
+      while True:
+        line = await reader.readline()
+        if not line:
+          break
+        received = time.monotonic()
+        request = None
+        try:
+          request = json.loads(line)
+          validate(request)
+        except ValueError as e:
+          reply = {'error': f'bad request: {e}'}
+          if isinstance(request, dict):
+            reply['id'] = request.get('id')
+          self.reply(writer, reply)
+          continue
+        wait = request.get('deadline')
+        deadline = received + (self.deadline if wait is None else wait)
+        future = loop.create_future()
+        # The request is answered at its deadline if it is still waiting
+        # for a worker then, not only once a dispatcher gets to it
+        timer = loop.call_later(max(deadline - time.monotonic(), 0),
+                                self.expire, future)
+        task = asyncio.create_task(self.answer(writer, request, received,
+                                               future))
+        replies.add(task)
+        task.add_done_callback(replies.discard)
+        await self.queue.put((request, deadline, future, timer))
+      await asyncio.gather(*replies)
+    except ConnectionError:
+      pass
+    finally:
+      writer.close()
+
+  async def answer(self, writer, request, received, future):
+    reply = await future
+    reply['id'] = request.get('id')
+    reply['latency'] = time.monotonic() - received
+    try:
+      self.reply(writer, reply)
+      await writer.drain()
+    except ConnectionError:
+      pass
+
+  def reply(self, writer, reply):
+    writer.write(json.dumps(reply).encode() + b'\n')
+
+  def expire(self, future):
+    if not future.done():
+      future.set_result({'error': 'deadline passed in the queue'})
+
+  async def dispatch(self):
+    loop = asyncio.get_running_loop()
+    while True:
+      (request, deadline, future, timer) = await self.queue.get()
+      timer.cancel()
+      remaining = deadline - time.monotonic()
+      if remaining <= 0:
+        self.expire(future)
+      if future.done():
+        continue
+      # The search stops short of the deadline to leave time for the reply
+      limits = dict(request.get('limits') or {})
+      limit = limits.get('time')
+      budget = remaining * (1 - SLACK)
+      limits['time'] = budget if limit is None else min(limit, budget)
+      job = loop.run_in_executor(self.pool, search, request, limits)
+      try:
+        record = await asyncio.wait_for(asyncio.shield(job), remaining)
+        future.set_result({'record': record})
+      except asyncio.TimeoutError:
+        future.set_result({'error': 'deadline passed in the search'})
+        # The worker cannot be interrupted: this dispatcher waits for it to
+        # finish, so no more searches run than there are workers
+        try:
+          await job
+        except Exception:
+          pass
+      except Exception as e:
+        future.set_result({'error': f'{type(e).__name__}: {e}'})
+
+
+def position(n, s, blocks, rng):
+  # Rows of a random position of the board that is not over yet
+  board = Board(n, s, blocks)
+  player = 'X'
+  for _ in range(0, rng.randrange(0, n * n - len(blocks))):
+    idx = rng.choice(list(board.candidates()))
+    board.play(idx, player)
+    if board.result() is not None:
+      board.undo(idx, player)
+      break
+    player = 'O' if player == 'X' else 'X'
+  return board.rows()
+
+
+def percentile(values, p):
+  values = sorted(values)
+  return values[min(len(values) - 1, int(p * len(values)))]
+
+
+async def load(host, port, path, connections, requests, template, seed=None):
+  # Closed-loop load test: each connection sends its next request as soon
+  # as the previous one is answered. Returns the latencies of the answered
+  # requests, the number of errors and the wall time.
+  rng = random.Random(seed)
+  (n, s) = (template['n'], template['s'])
+  blocks = [tuple(block) for block in template.get('blocks', [])]
+  latencies = []
+  errors = 0
+
+  async def client(k):
+    nonlocal errors
+    if path is not None:
+      (reader, writer) = await asyncio.open_unix_connection(path)
+    else:
+      (reader, writer) = await asyncio.open_connection(host, port)
+    for i in range(k, requests, connections):
+      request = dict(template, id=i, board=position(n, s, blocks, rng))
+      sent = time.monotonic()
+      writer.write(json.dumps(request).encode() + b'\n')
+      await writer.drain()
+      reply = json.loads(await reader.readline())
+      if 'error' in reply:
+        errors += 1
+      else:
+        latencies.append(time.monotonic() - sent)
+    writer.close()
+    await writer.wait_closed()
+
+  start = time.monotonic()
+  await asyncio.gather(*(client(k) for k in range(0, connections)))
+  return (latencies, errors, time.monotonic() - start)
+
+
+async def serve(args):
+  service = Service(args.workers, args.queue, args.deadline)
+  server = await service.start(args.host, args.port, args.unix)
+  try:
+    async with server:
+      await server.serve_forever()
+  finally:
+    service.close()
+
+
+def main():
+  parser = argparse.ArgumentParser(description='best-move service')
+  parser.add_argument('mode', choices=['serve', 'load'])
+  parser.add_argument('--host', default='127.0.0.1')
+  parser.add_argument('--port', type=int, default=7878)
+  parser.add_argument('--unix', help='Unix socket path instead of TCP')
+  parser.add_argument('--workers', type=int)
+  parser.add_argument('--queue', type=int, default=64,
+                      help='requests waiting for a worker at most')
+  parser.add_argument('--deadline', type=float, default=30.0,
+                      help='seconds a request may take by default')
+  parser.add_argument('--connections', type=int, default=8)
+  parser.add_argument('--requests', type=int, default=200)
+  parser.add_argument('--request', default='{"n": 4, "s": 3, '
+                      '"limits": {"depth": 4}}',
+                      help='load test request without id and board, as JSON')
+  parser.add_argument('--seed', type=int)
+  args = parser.parse_args()
+  if args.mode == 'serve':
+    try:
+      asyncio.run(serve(args))
+    except KeyboardInterrupt:
+      pass
+    return
+  (latencies, errors, elapsed) = asyncio.run(
+      load(args.host, args.port, args.unix, args.connections, args.requests,
+           json.loads(args.request), args.seed))
+  print(f'{len(latencies)} moves, {errors} errors in {elapsed:.2f}s')
+  if latencies:
+    print(f'p50 {percentile(latencies, 0.5) * 1000:.1f}ms, '
+          f'p99 {percentile(latencies, 0.99) * 1000:.1f}ms, '
+          f'{len(latencies) / elapsed:.1f} moves/s')
+
+
+if __name__ == '__main__':
+  main()
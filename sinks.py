@@ -0,0 +1,55 @@
+# Output sinks for the game driver.
+#
+# Game writes what it shows on the console to its out sink and the
+# gameTrace text to its trace sink. ConsoleSink prints, BufferedSink joins
+# small writes into large ones to a file and NullSink drops everything. A
+# board is only formatted when one of the sinks is active, so headless
+# self-play does no output work at all.
+
+import sys
+
+
+class NullSink:
+  active = False
+
+  def write(self, text):
+    pass
+
+  def flush(self):
+    pass
+
+
+class ConsoleSink(NullSink):
+  active = True
+
+  def __init__(self, stream=None):
+    # None follows sys.stdout, so redirecting it redirects the sink too
+    self.stream = stream
+
+  def write(self, text):
+    (self.stream or sys.stdout).write(text)
+
+  def flush(self):
+    (self.stream or sys.stdout).flush()
+
+
+class BufferedSink(NullSink):
+  active = True
+
+  def __init__(self, file, size=1 << 16):
+    self.file = file
+    self.size = size
+    self.parts = []
+    self.length = 0
+
+  def write(self, text):
+    self.parts.append(text)
+    self.length += len(text)
+    if self.length >= self.size:
+      self.flush()
+
+  def flush(self):
+    if self.parts:
+      self.file.write(''.join(self.parts))
+      self.parts = []
+      self.length = 0
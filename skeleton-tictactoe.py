@@ -1,14 +1,26 @@
 # based on code from https://stackabuse.com/minimax-and-alpha-beta-pruning-in-python
+#
+# The search itself lives in engine.py; this is the driver that plays games
+# between humans and the engine and runs the scoreboard tournament.
 
+import os
+import json
+import math
 import time
-import sys
-import math as m
+import argparse
+import contextlib
+import multiprocessing
 from collections import Counter
 
+from engine import Engine, Ponder
+from transposition import TranspositionTable
+from sinks import NullSink, ConsoleSink, BufferedSink
+from telemetry import format_move, format_summary
+from gamerecord import encode, from_game
+from timecontrol import TimeManager
 
-class Game:
-  MINIMAX = 0
-  ALPHABETA = 1
+
+class Game(Engine):
   HUMAN = 2
   AI = 3
 
@@ -22,128 +34,70 @@ class Game:
                e1=1,
                e2=2,
                t=10,
-               f=None):
-    E = {1: self.e1, 2: self.e2}
-    self.n = n
-    self.initialize_game()
-    if blocks:
-      self.add_blocks(blocks)
-    self.s = s
+               f=None,
+               out=None,
+               ponder=False,
+               clock=None,
+               **options):
+    # clock: (total, increment) seconds per side for the whole game instead
+    # of t per move, spent by a TimeManager between iterations of iterative
+    # deepening
+    if clock is not None:
+      options['deepening'] = True
+    super().__init__(n=n,
+                     blocks=blocks,
+                     s=s,
+                     depth1=depth1,
+                     depth2=depth2,
+                     e1=e1,
+                     e2=e2,
+                     t=t,
+                     **options)
     self.recommend = recommend
-    self.depth1 = depth1
-    self.depth2 = depth2
-    self.score1 = E[e1]
-    self.score2 = E[e2]
-    self.time_limit = t
+    # Console output and the gameTrace file; a file is written through a
+    # BufferedSink and a NullSink turns either off
+    self.out = ConsoleSink() if out is None else out
+    if f is None:
+      f = NullSink()
+    elif not isinstance(f, NullSink):
+      f = BufferedSink(f)
     self.f = f
-    self.moves = 0
-    self.e1_invocations = 0
-    self.e2_invocations = 0
-    self.invocations = 0
+    # Search the AI's replies while a human plays against it; the results
+    # are passed on through the transposition table
+    self.ponderer = None
+    self.pondered = None
+    if ponder:
+      if self.tt is None:
+        self.tt = TranspositionTable(entries=1 << 16)
+      self.ponderer = Ponder(self)
+    self.manager = None
+    if clock is not None:
+      self.manager = TimeManager(*clock)
+      self.on_iteration = self.manager.iteration
     self.total_depth_evals = Counter(
         {i: 0
          for i in range(1,
                         max(depth2, depth1) + 1)})
 
-  def initialize_game(self):
-
-    self.current_state = [['.' for x in range(0, self.n)]
-                          for x in range(0, self.n)]
-    # Player X always plays first
-    self.player_turn = 'X'
-
   def draw_board(self):
-    print()
-    for x in range(0, self.n):
-      for y in range(0, self.n):
-        print(F'{self.current_state[x][y]}', end='')
-        if self.f: self.f.write(F'{self.current_state[x][y]}')
-      print()
-      if self.f: self.f.write('\n')
-    print()
-    if self.f: self.f.write('\n')
-
-  def is_valid(self, px, py):
-    if px < 0 or px > self.n - 1 or py < 0 or py > self.n - 1:
-      return False
-    elif self.current_state[px][py] != '.':
-      return False
-    else:
-      return True
-
-  def is_end(self):
-    # Vertical win
-    for i in range(0, self.n):
-      column = ''
-      for j in range(0, self.n):
-        column += self.current_state[j][i]
-      if 'X' * self.s in column:
-        return 'X'
-      elif 'O' * self.s in column:
-        return 'O'
-    # Horizontal win
-    for i in range(0, self.n):
-      row = ''.join(self.current_state[i])
-      if 'X' * self.s in row:
-        return 'X'
-      elif 'O' * self.s in row:
-        return 'O'
-    # diagonals:
-    for x in range(0, self.n):
-      anti_diagonal = ''
-      anti_diagonal2 = ''
-      diagonal = ''
-      diagonal2 = ''
-      for i, j in zip(range(x, -1, -1), range(0, x + 1)):
-        k = self.n - i - 1
-        l = j
-        diagonal += self.current_state[k][l]
-        diagonal2 += self.current_state[self.n - k - 1][self.n - l - 1]
-        anti_diagonal += self.current_state[i][j]
-        anti_diagonal2 += self.current_state[self.n - i - 1][self.n - i - 1]
-      xpattern = 'X' * self.s
-      opattern = 'O' * self.s
-      if (xpattern in anti_diagonal or xpattern in anti_diagonal2
-          or xpattern in diagonal or xpattern in diagonal2):
-        return 'X'
-      elif (opattern in anti_diagonal or opattern in anti_diagonal2
-            or opattern in diagonal or opattern in diagonal2):
-        return 'O'
-
-    # Is whole board full?
-    for i in range(0, self.n):
-      for j in range(0, self.n):
-        # There's an empty field, we continue the game
-        if (self.current_state[i][j] == '.'):
-          return None
-    # It's a tie!
-    return '.'
+    if not (self.out.active or self.f.active):
+      return
+    rows = ''.join(row + '\n' for row in self.board.rows())
+    self.out.write('\n' + rows + '\n')
+    self.f.write(rows + '\n')
 
   def check_end(self):
     self.result = self.is_end()
     # Printing the appropriate message if the game has ended
     if self.result != None:
       if self.result == 'X':
-        print('The winner is X!')
+        self.out.write('The winner is X!\n')
       elif self.result == 'O':
-        print('The winner is O!')
+        self.out.write('The winner is O!\n')
       elif self.result == '.':
-        print('It\'s a tie!')
-      if self.f:
-        if self.result == ',':
-          self.f.write('It\'s a tie.\n')
-        else:
-          self.f.write(f'The winner is {self.result}.\n\n')
-        avg_time = sum(self.total_times) / len(self.total_times)
-        avg_ev_depth = sum(self.total_depths) / len(self.total_depths)
-
-        self.f.write(f'6(b)i\tAverage evaluation time: {avg_time:.2f}s\n')
-        self.f.write(
-            f'6(b)ii\tTotal heuristic evaluations: {self.total_evals}\n')
-        self.f.write(
-            f'6(b)iii\tEvaluations by depth: {dict(self.total_depth_evals)}\n')
-        self.f.write(f'6(b)iv\tAverage evaluation depth: {avg_ev_depth:.2f}\n')
-        self.f.write(f'6(b)vi Total moves: {self.total_moves}\n')
+        self.out.write('It\'s a tie!\n')
+      if self.f.active:
+        self.f.write(format_summary(self.records, self.result))
       self.initialize_game()
     return self.result
 
@@ -157,202 +111,33 @@ class Game:
       else:
         print('The move is not valid! Try again.')
 
-  def switch_player(self):
-    self.moves += 1
+
+  def ponder(self, record, algo):
+    # Likely human moves: the one the search recommends, then the rest in
+    # search order
+    board = self.board
+    best = board.index(record['row'], record['column'])
+    if self.ordering is not None:
+      moves = self.ordering.order(board, 0, self.player_turn == 'O', best)
+    else:
+      moves = board.candidates()
+    moves = [best] + [idx for idx in moves if idx != best]
     if self.player_turn == 'X':
-      self.player_turn = 'O'
-    elif self.player_turn == 'O':
-      self.player_turn = 'X'
-    return self.player_turn
-
-  def minimax(self, max=False, d=0, start=0, limit=10, current=0):
-    # Minimizing for 'X' and maximizing for 'O'
-    # Possible values are:
-    # -maxint - win for 'X'
-    # 0  - a tie
-    # maxint  - loss for 'X'
-    # We're initially setting it to inf or -inf as worse than the worst case:
-    t = time.time() - start
-    value = float('inf')
-    if max:
-      value = float('-inf')
-    x = None
-    y = None
-    result = self.is_end()
-    if result == 'X':
-      self.depth_evals[current] += 1
-      return (-sys.maxsize + 1, x, y)
-    elif result == 'O':
-      self.depth_evals[current] += 1
-      return (sys.maxsize - 1, x, y)
-    elif result == '.':
-      self.depth_evals[current] += 1
-      return (0, x, y)
-    elif current == d or t >= (limit - 0.5):  #max depth reached or time
-
-      for i in range(0, self.n):
-        for j in range(0, self.n):
-          if self.current_state[i][j] == '.':
-            if max:
-              self.current_state[i][j] = 'O'
-              v = self.score1()
-              # print('2: ', v)
-              if v > value:
-                value = v
-                x = i
-                y = j
-            else:
-              self.current_state[i][j] = 'X'
-              v = self.score2()
-              # print('v1: ', v)
-              if v < value:
-                value = v
-                x = i
-                y = j
-            self.current_state[i][j] = '.'
-      self.depth_evals[current] += 1
-      return (value, x, y)
-    current += 1
-    for i in range(0, self.n):
-      for j in range(0, self.n):
-        if self.current_state[i][j] == '.':
-          if max:
-            self.current_state[i][j] = 'O'
-            (v, _, _) = self.minimax(max=False,
-                                     d=d,
-                                     start=start,
-                                     limit=limit,
-                                     current=current)
-            if v > value:
-              value = v
-              x = i
-              y = j
-          else:
-            self.current_state[i][j] = 'X'
-            (v, _, _) = self.minimax(max=True,
-                                     d=d,
-                                     start=start,
-                                     limit=limit,
-                                     current=current)
-            if v < value:
-              value = v
-              x = i
-              y = j
-          self.current_state[i][j] = '.'
-    self.depth_evals[current] += 1
-    return (value, x, y)
-
-  def alphabeta(self,
-                alpha=-2,
-                beta=2,
-                max=False,
-                d=0,
-                start=0,
-                limit=10,
-                current=0):
-    # Minimizing for 'X' and maximizing for 'O'
-    # Possible values are:
-    # -1 - win for 'X'
-    # 0  - a tie
-    # 1  - loss for 'X'
-    # We're initially setting it to 2 or -2 as worse than the worst case:
-    t = time.time() - start
-    value = float('inf')
-    if max:
-      value = float('-inf')
-    x = None
-    y = None
-    result = self.is_end()
-    # print(start, t, limit)
-    if result == 'X':
-      self.depth_evals[current] += 1
-      return (-sys.maxsize + 1, x, y)
-    elif result == 'O':
-      self.depth_evals[current] += 1
-      return (sys.maxsize - 1, x, y)
-    elif result == '.':
-      self.depth_evals[current] += 1
-      return (0, x, y)
-    elif current == d or t >= (limit - 0.5):  #max depth or time reached
-      if t >= limit:
-        print('time limit reached')
-        if max: return (float('-inf'), x, y)
-        else: return (float('inf'), x, y)
-      for i in range(0, self.n):
-        for j in range(0, self.n):
-          if self.current_state[i][j] == '.':
-            if max:
-              self.current_state[i][j] = 'O'
-              v = self.score1()
-              # print('2: ', v)
-              if v > value:
-                value = v
-                x = i
-                y = j
-            else:
-              self.current_state[i][j] = 'X'
-              v = self.score2()
-              # print('v1: ', v)
-              if v < value:
-                value = v
-                x = i
-                y = j
-            self.current_state[i][j] = '.'
-      self.depth_evals[current] += 1
-      return (value, x, y)
-    current += 1
-    for i in range(0, self.n):
-      for j in range(0, self.n):
-        if self.current_state[i][j] == '.':
-          if max:
-            self.current_state[i][j] = 'O'
-            (v, _, _) = self.alphabeta(alpha,
-                                       beta,
-                                       max=False,
-                                       d=d,
-                                       start=start,
-                                       limit=limit,
-                                       current=current)
-            if v > value:
-              value = v
-              x = i
-              y = j
-          else:
-            self.current_state[i][j] = 'X'
-            (v, _, _) = self.alphabeta(alpha,
-                                       beta,
-                                       max=True,
-                                       d=d,
-                                       start=start,
-                                       limit=limit,
-                                       current=current)
-            if v < value:
-              value = v
-              x = i
-              y = j
-          self.current_state[i][j] = '.'
-          if max:
-            if value >= beta:
-              self.depth_evals[current] += 1
-              return (value, x, y)
-            if value > alpha:
-              alpha = value
-          else:
-            if value <= alpha:
-              self.depth_evals[current] += 1
-              return (value, x, y)
-            if value < beta:
-              beta = value
-    self.depth_evals[current] += 1
-    return (value, x, y)
+      depth = self.depth2
+    else:
+      depth = self.depth1
+    self.ponderer.start(board, self.player_turn, moves, {
+        'depth': depth,
+        'algo': algo
+    })
+
+  def close(self):
+    if self.ponderer is not None:
+      self.ponderer.stop()
+    super().close()
 
   def play(self, algo=None, player_x=None, player_o=None):
-    self.total_evals = 0
-    self.total_times = []
-    self.total_depths = []
-    self.total_moves = 0
-    moves = 0
-    limit = self.time_limit
+    self.records = []
     if algo == None:
       algo = self.ALPHABETA
     if player_x == None:
@@ -360,33 +145,31 @@ class Game:
     if player_o == None:
       player_o = self.HUMAN
     while True:
-      moves += 1
-      self.depth_evals = Counter(
-          {i: 0
-           for i in range(1,
-                          max(self.depth1, self.depth2) + 1)})
-      d1 = self.depth1
-      d2 = self.depth2
       self.draw_board()
       r = self.check_end()
       if r:
+        self.close()
+        self.out.flush()
+        self.f.flush()
+        avg_depth = sum(record['avg_depth']
+                        for record in self.records) / len(self.records)
         ans = (r, self.invocations, self.moves, self.total_depth_evals,
-               (time.time() - start),
-               (sum(self.total_depths) / len(self.total_depths)))
+               (time.time() - start), avg_depth)
         return ans
 
       start = time.time()
-      if algo == self.MINIMAX:
-        if self.player_turn == 'X':
-          (m, x, y) = self.minimax(max=False, d=d1, start=start, limit=limit)
-        else:
-          (m, x, y) = self.minimax(max=True, d=d2, start=start, limit=limit)
-      else:  # algo == self.ALPHABETA
-        if self.player_turn == 'X':
-          (m, x, y) = self.alphabeta(max=False, d=d1, start=start, limit=limit)
-        else:
-          (m, x, y) = self.alphabeta(max=True, d=d2, start=start, limit=limit)
-      end = time.time()
+      clocked = self.manager is not None and (
+          self.player_turn == 'X' and player_x == self.AI or
+          self.player_turn == 'O' and player_o == self.AI)
+      limits = {'algo': algo}
+      if clocked:
+        limits.update(self.manager.allocate(self, algo))
+      record = self.think(limits)
+      if clocked:
+        self.manager.spend(self.player_turn, record)
+      (x, y) = (record['row'], record['column'])
+      if record['timed_out']:
+        self.out.write('time limit reached\n')
       if (self.player_turn == 'X'
           and player_x == self.HUMAN) or (self.player_turn == 'O'
                                           and player_o == self.HUMAN):
@@ -395,128 +178,74 @@ class Game:
         #   if self.f:
         #     self.f.write(F'i\t\tEvaluation time: {round(end - start, 7)}s\n')
         #   print(F'Recommended move: x = {x}, y = {y}')
+        self.out.flush()
+        ai = player_o if self.player_turn == 'X' else player_x
+        if self.ponderer is not None and ai == self.AI:
+          self.ponder(record, algo)
         (x, y) = self.input_move()
+        if self.ponderer is not None and ai == self.AI:
+          self.pondered = self.board.index(x, y) in self.ponderer.stop()
+        record['human'] = True
+        record['row'] = x
+        record['column'] = y
       if (self.player_turn == 'X'
           and player_x == self.AI) or (self.player_turn == 'O'
                                        and player_o == self.AI):
-        print(F'Evaluation time: {round(end - start, 7)}s')
-        print(
-            F'Player {self.player_turn} under AI control plays: x = {x}, y = {y}'
+        self.out.write(
+            F'Evaluation time: {round(record["time"], 7)}s\n'
+            F'Player {self.player_turn} under AI control plays: x = {x}, y = {y}\n'
         )
-        avg = sum(k * v for k, v in self.depth_evals.items()) / sum(
-            self.depth_evals.values())
-        if self.f:
-          self.f.write(
-              F'Player {self.player_turn} under AI control plays: row:{x}, column:{y}\n\n'
-          )
-          self.f.write(F'i\t\tEvaluation time: {round(end - start, 7)}s\n')
-          self.f.write(f'ii\tHeuristic evaluations: ')
-          if self.player_turn == 'X':
-            self.f.write(f'{self.e1_invocations}\n')
-          else:
-            self.f.write(f'{self.e2_invocations}\n')
-          self.f.write(
-              f'iii\tEvaluations by depth: {dict(self.depth_evals)}\n')
-
-          self.f.write(f'iv\tAverage evaluation depth: {avg:.2f}\n')
-      # self.e1_invocations = 0
-      # self.e2_invocations = 0
-      self.current_state[x][y] = self.player_turn
+        if self.deepening:
+          self.out.write(F'Depth reached: {self.depth_reached}\n')
+        if self.pondered is not None:
+          record['pondered'] = self.pondered
+          self.pondered = None
+        if self.f.active:
+          self.f.write(format_move(record))
+      if self.telemetry is not None:
+        self.telemetry.emit(record)
+      self.records.append(record)
+      self.board.play(self.board.index(x, y), self.player_turn)
       self.switch_player()
-      self.total_evals += sum(self.depth_evals.values())
-
-      self.total_times.append(round(end - start, 7))
-      self.total_depths.append(avg)
-      self.total_moves += moves
       self.total_depth_evals += self.depth_evals
 
-  def e1(self):
-    self.invocations += 1
-    self.e1_invocations += 1
-    score = 0
-    lines = []
-    for i in range(0, self.n):
-      column = ''
-      for j in range(0, self.n):
-        column += self.current_state[j][i]
-      lines.append(column)
-    # Horizontal
-    for i in range(0, self.n):
-      row = ''.join(self.current_state[i])
-      lines.append(row)
-
-    for x in range(0, self.n):
-      anti_diagonal = ''
-      anti_diagonal2 = ''
-      diagonal = ''
-      diagonal2 = ''
-      for i, j in zip(range(x, -1, -1), range(0, x + 1)):
-        k = self.n - i - 1
-        l = j
-        diagonal += self.current_state[k][l]
-        diagonal2 += self.current_state[self.n - k - 1][self.n - l - 1]
-        anti_diagonal += self.current_state[i][j]
-        anti_diagonal2 += self.current_state[self.n - i - 1][self.n - i - 1]
-      lines += [diagonal, diagonal2, anti_diagonal, anti_diagonal2]
-
-    for line in lines:
-      if 'X' * self.s in line:
-        score = -sys.maxsize + 1
-        return score
-      elif 'O' * self.s in line:
-        score = sys.maxsize - 1
-        return score
-      elif 'X' not in line and 'O' in line:
-        score += line.count('O')
-      elif 'X' in line and 'O' not in line:
-        score -= line.count('X')
-    return score
-
-  def e2(self):
-    self.invocations += 1
-    self.e2_invocations += 1
-    score = 0
-    center = self.n // 2
-    for i in range(0, self.n):
-      for j in range(0, self.n):
-        element = self.current_state[i][j]
-        x = i - center
-        y = j - center
-        distance = m.sqrt(x**2 + y**2)
-        if element == 'X':
-          score -= center - distance
-        elif element == 'O':
-          score += center - distance
-    return score
-
-  def add_blocks(self, b):
-    for block in b:
-      self.current_state[block[0]][block[1]] = '*'
-
-
-def main():
-  #yapf: disable
-  GAMES = [
-      {'n':4,'b':4, 's':3, 't':5,
-          'd1':6, 'd2':6, 'algo': False,'blocks': [(0, 0), (0, 3), (3, 0), (3, 3)]},
-      {'n':4,'b':4, 's':3, 't':1,
-          'd1':6, 'd2':6, 'algo': True,'blocks': [(1, 0), (2, 2)]},
-      {'n': 5, 'b':4 ,'s':4 , 't':1,
-          'd1':6, 'd2':6, 'algo':True, 'blocks':[]},
-      {'n':5, 'b':4,'s':4, 't':5,
-      'd1':6, 'd2':6, 'algo':True, 'blocks':[]},
-      {'n':8, 'b':5,'s':5, 't':1,
-      'd1':2, 'd2':6, 'algo':True, 'blocks':[]},
-      {'n':8, 'b':5,'s':5, 't':5,
-      'd1':2, 'd2':6, 'algo':True, 'blocks':[]},
-      {'n':8, 'b':6,'s':5, 't':1,
-      'd1':6, 'd2':6, 'algo':True, 'blocks':[]},
-      {'n':8, 'b':6,'s':5, 't':1,
-      'd1':6, 'd2':6, 'algo':True, 'blocks': [(0,0),(1,1),
-                                              (2,2),(3,3),
-                                              (4,4),(5,5),
-                                              (6,6),(7,7)]},
-  ]
+FILE = 'scoreboard.txt'
+CHECKPOINT = 'scoreboard.jsonl'
+# Solved-position files given to every game of the tournament
+SOLVED = ()
+
+
+def _set_solved(solved):
+  global SOLVED
+  SOLVED = tuple(solved)
+
+
+#yapf: disable
+GAMES = [
+    {'n':4,'b':4, 's':3, 't':5,
+        'd1':6, 'd2':6, 'algo': False,'blocks': [(0, 0), (0, 3), (3, 0), (3, 3)]},
+    {'n':4,'b':4, 's':3, 't':1,
+        'd1':6, 'd2':6, 'algo': True,'blocks': [(1, 0), (2, 2)]},
+    {'n': 5, 'b':4 ,'s':4 , 't':1,
+        'd1':6, 'd2':6, 'algo':True, 'blocks':[]},
+    {'n':5, 'b':4,'s':4, 't':5,
+    'd1':6, 'd2':6, 'algo':True, 'blocks':[]},
+    {'n':8, 'b':5,'s':5, 't':1,
+    'd1':2, 'd2':6, 'algo':True, 'blocks':[]},
+    {'n':8, 'b':5,'s':5, 't':5,
+    'd1':2, 'd2':6, 'algo':True, 'blocks':[]},
+    {'n':8, 'b':6,'s':5, 't':1,
+    'd1':6, 'd2':6, 'algo':True, 'blocks':[]},
+    {'n':8, 'b':6,'s':5, 't':1,
+    'd1':6, 'd2':6, 'algo':True, 'blocks': [(0,0),(1,1),
+                                            (2,2),(3,3),
+                                            (4,4),(5,5),
+                                            (6,6),(7,7)]},
+]
+#yapf: enable
+
+
+def main(workers=None, checkpoint=CHECKPOINT, solved=(), records=None):
   # for game in GAMES:
   #   n, b, s, t = (game["n"],game["b"], game["s"],game["t"] )
   #   file = f'gameTrace-{n}{b}{s}{t}.txt'
@@ -539,63 +268,260 @@ def main():
   #     player_o=Game.AI,
   #     )
   r = 10
-  FILE = 'scoreboard.txt'
-  with open(FILE, 'w')as f:
+  # Every game of the scoreboard as (config, game number, colours swapped)
+  tasks = [(game, j, swapped)
+           for game in GAMES
+           for swapped in (False, True)
+           for j in range(0, r)]
+  done = load_checkpoint(checkpoint)
+  pending = [task for task in tasks if game_key(*task) not in done]
+  _set_solved(solved)
+  with open(checkpoint, 'a') as c, open_records(records) as games:
+    if workers == 1:
+      results = map(play_game, pending)
+    else:
+      pool = multiprocessing.Pool(workers,
+                                  initializer=_set_solved,
+                                  initargs=(solved,))
+      results = pool.imap_unordered(play_game, pending)
+    for record in results:
+      save(record, c, games)
+      done[game_key(record['config'], record['game'],
+                    record['swapped'])] = record
+    if workers != 1:
+      pool.close()
+      pool.join()
+  write_scoreboard(GAMES, r, done, FILE)
+
+
+def sprt(wins, losses, p0, p1, alpha, beta):
+  # Sequential probability ratio test of e1 against e2 on the decisive
+  # games (draws say nothing about which is stronger), taken as Bernoulli
+  # trials won by e1 with probability p0 (e1 is not stronger) or p1 (it
+  # is). Returns the log-likelihood ratio and the bounds at which p1 (upper)
+  # or p0 (lower) is accepted with error rates alpha and beta.
+  llr = wins * math.log(p1 / p0) + losses * math.log((1 - p1) / (1 - p0))
+  return (llr, math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha))
+
+
+def match(game, done, c, games, results, batch, p0, p1, alpha, beta,
+          pairs):
+  # Colour-alternating game pairs of one config until the SPRT decides or
+  # pairs have been played. A deterministic game would only repeat itself,
+  # so it is played (and counted as a trial) once per colour assignment;
+  # once both are deterministic the pair result is all there is to know
+  # and the match ends there. Returns the summary for the scoreboard.
+  repeats = {}
+  trials = []
+  wins = losses = played = 0
+  (llr, lower, upper) = sprt(0, 0, p0, p1, alpha, beta)
+  decision = None
+  j = 0
+  while j < pairs and decision is None:
+    # A single pair first, to find out whether the games repeat
+    size = 1 if j == 0 else batch
+    tasks = [(game, k, swapped)
+             for k in range(j, min(j + size, pairs))
+             for swapped in (False, True)]
+    pending = [task for task in tasks
+               if game_key(*task) not in done and task[2] not in repeats]
+    for record in results(pending):
+      save(record, c, games)
+      done[game_key(record['config'], record['game'],
+                    record['swapped'])] = record
+      played += 1
+    for task in tasks:
+      record = done.get(game_key(*task))
+      if record is None or task[2] in repeats:
+        continue
+      if record.get('deterministic'):
+        repeats[task[2]] = record
+      trials.append(game_key(*task))
+      w = record['winner']
+      if w == ('O' if task[2] else 'X'):
+        wins += 1
+      elif w == ('X' if task[2] else 'O'):
+        losses += 1
+    j += len(tasks) // 2
+    (llr, lower, upper) = sprt(wins, losses, p0, p1, alpha, beta)
+    if llr >= upper:
+      decision = 'e1 stronger'
+    elif llr <= lower:
+      decision = 'e1 not stronger'
+    elif len(repeats) == 2:
+      scores = [
+          1 if w == e1 else 0 if w in 'XO' else 0.5
+          for (w, e1) in ((repeats[False]['winner'], 'X'),
+                          (repeats[True]['winner'], 'O'))
+      ]
+      decision = (f'deterministic, e1 scores {sum(scores):g} of 2 '
+                  f'in every pair')
+  return {
+      'trials': trials,
+      'played': played,
+      'llr': llr,
+      'bounds': (lower, upper),
+      'decision': decision or 'undecided',
+  }
+
+
+def main_sprt(workers=None, checkpoint=CHECKPOINT, solved=(), records=None,
+              p0=0.5, p1=0.65, alpha=0.05, beta=0.05, pairs=50):
+  # The tournament as sequential matches: each config stops as soon as the
+  # SPRT can tell whether e1 beats e2, instead of after a fixed 20 games
+  done = load_checkpoint(checkpoint)
+  _set_solved(solved)
+  if workers == 1:
+    results = lambda tasks: map(play_game, tasks)
+    batch = 1
+  else:
+    pool = multiprocessing.Pool(workers,
+                                initializer=_set_solved,
+                                initargs=(solved,))
+    results = lambda tasks: pool.imap_unordered(play_game, tasks)
+    batch = workers or os.cpu_count() or 1
+  matches = {}
+  with open(checkpoint, 'a') as c, open_records(records) as games:
     for game in GAMES:
-
+      matches[json.dumps(game, sort_keys=True)] = match(
+          game, done, c, games, results, batch, p0, p1, alpha, beta, pairs)
+  if workers != 1:
+    pool.close()
+    pool.join()
+  write_scoreboard(GAMES, pairs, done, FILE, matches)
+
+
+def open_records(records):
+  # The binary game-record file (see gamerecord.py) games are appended to,
+  # if any
+  if records is None:
+    return contextlib.nullcontext()
+  return open(records, 'ab')
+
+
+def save(record, c, games):
+  # Stream a finished game to the checkpoint and, if there is a record
+  # file, its moves to the record file
+  data = record.pop('game_record')
+  if games is not None:
+    games.write(data)
+    games.flush()
+  c.write(json.dumps(record) + '\n')
+  c.flush()
+
+
+def game_key(game, j, swapped):
+  return (json.dumps(game, sort_keys=True), j, swapped)
+
+
+def load_checkpoint(checkpoint):
+  # Finished games from an earlier (possibly interrupted) run; a line cut
+  # short by a crash is dropped from the file, so that the records
+  # appended next start on a line of their own, and its game played again
+  done = {}
+  if not os.path.exists(checkpoint):
+    return done
+  with open(checkpoint, 'rb+') as c:
+    data = c.read()
+    if data and not data.endswith(b'\n'):
+      c.truncate(data.rfind(b'\n') + 1)
+  with open(checkpoint) as c:
+    for line in c:
+      try:
+        record = json.loads(line)
+      except ValueError:
+        continue
+      done[game_key(record['config'], record['game'],
+                    record['swapped'])] = record
+  return done
+
+
+def play_game(task):
+  (game, j, swapped) = task
+  g = Game(recommend=False,
+           n=game['n'],
+           s=game['s'],
+           t=game['t'],
+           depth1=game['d1'],
+           depth2=game['d2'],
+           blocks=game['blocks'],
+           e1=2 if swapped else 1,
+           e2=1 if swapped else 2,
+           out=NullSink(),
+           solved=SOLVED,
+           clock=game.get('clock'))
+  w, evals, moves, evals_depth, t, avg_ev_depth = g.play(
+      algo=game['algo'],
+      player_x=Game.AI,
+      player_o=Game.AI,
+  )
+  return {
+      'config': game,
+      'game': j,
+      'swapped': swapped,
+      'winner': w,
+      'evals': evals,
+      'moves': moves,
+      'evals_depth': dict(evals_depth),
+      't': t,
+      'avg_depth': avg_ev_depth,
+      # Searches the clock did not cut short play the same game every time;
+      # a game clock hands out time by how long the moves before took, and
+      # MCTS playouts are only repeatable with a seed
+      'deterministic': (g.manager is None and
+                        (game['algo'] != Game.MCTS or g.seed is not None) and
+                        not any(record['truncated'] for record in g.records)),
+      'game_record': encode(from_game(g, game['algo'], w)),
+  }
+
+
+def write_scoreboard(games, r, done, file, matches=None):
+  # matches holds the SPRT summary of each config in match mode, where
+  # the games counted differ between configs
+  with open(file, 'w') as f:
+    for game in games:
+      m = matches[json.dumps(game, sort_keys=True)] if matches else None
+      if m is None:
+        keys = [game_key(game, j, swapped)
+                for swapped in (False, True)
+                for j in range(0, r)]
+      else:
+        keys = m['trials']
       wins_e1 = 0
       wins_e2 = 0
       i = []
       ii = 0
       iii = Counter({})
       iv = []
-      v = []
       vi = []
       f.write(f'n={game["n"]} b={len(game["blocks"])} s={game["s"]} t={game["t"]}\n')
       f.write(f'\nPlayer 1: d={game["d1"]} a={game["algo"]}\n')
       f.write(f'Player 2: d={game["d2"]} a={game["algo"]}\n')
-      f.write(f'\n10 games\n')
-      for j in range(0, r):
-        g = Game(recommend=False,
-              n=game['n'],
-              s=game['s'],
-              t=game['t'],
-              depth1=game['d1'],
-              depth2=game['d2'],
-              blocks=game['blocks'])
-        w, evals, moves, evals_depth, t, avg_ev_depth= g.play(
-        algo=game['algo'],
-        player_x=Game.AI,
-        player_o=Game.AI,
-        )
-        if w == 'X': wins_e1 +=1
-        elif w=='O': wins_e2 +=1
-        i.append(t/moves)
-        ii += evals
-        iii += evals_depth
-        iv.append(avg_ev_depth)
-        vi.append(moves)
-      for j in range(0,r):
-        g = Game(recommend=False,
-              n=game['n'],
-              s=game['s'],
-              t=game['t'],
-              depth1=game['d1'],
-              depth2=game['d2'],
-              blocks=game['blocks'], e1=2, e2=1)
-        w, evals, moves, evals_depth, t, avg_ev_depth= g.play(
-        algo=game['algo'],
-        player_x=Game.AI,
-        player_o=Game.AI,
-        )
-        if w == 'O': wins_e1 +=1
-        elif w == 'X': wins_e2 +=1
-        i.append(t/moves)
-        ii += evals
-        iii += evals_depth
-        iv.append(avg_ev_depth)
+      if m is None:
+        f.write(f'\n{r} games\n')
+      else:
+        f.write(f'\n{len(keys)} games\n')
+        f.write(f'SPRT: {m["decision"]} (LLR {m["llr"]:.2f}, bounds '
+                f'{m["bounds"][0]:.2f} {m["bounds"][1]:.2f}), '
+                f'{m["played"]} games played in this run\n')
+      for key in keys:
+        record = done.get(key)
+        if record is None:
+          continue
+        swapped = record['swapped']
+        w = record['winner']
+        if w == ('O' if swapped else 'X'): wins_e1 += 1
+        elif w == ('X' if swapped else 'O'): wins_e2 += 1
+        moves = record['moves']
+        i.append(record['t'] / moves)
+        ii += record['evals']
+        iii += Counter({int(k): v for k, v in record['evals_depth'].items()})
+        iv.append(record['avg_depth'])
         vi.append(moves)
-      total_wins = wins_e1+wins_e2
+      if not vi:
+        f.write('\n')
+        continue
+      total_wins = (wins_e1 + wins_e2) or 1
       f.write(f'Total wins for heuristic e1: {wins_e1} ({wins_e1/total_wins*100:.1f}%)\n')
       f.write(f'Total wins for heuristic e2: {wins_e2} ({wins_e2/total_wins*100:.1f}%)\n')
       f.write(f'\ni\tAverage evaluation time: {sum(i)/len(i):.2f}\n')
@@ -606,4 +532,33 @@ def main():
 
 
 if __name__ == '__main__':
-  main()
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--workers', type=int, default=None,
+                      help='games played in parallel (default: one per CPU)')
+  parser.add_argument('--checkpoint', default=CHECKPOINT,
+                      help='file finished games are streamed to and resumed from')
+  parser.add_argument('--solved', nargs='*', default=[], metavar='FILE',
+                      help='solved-position files (see solved.py) for the '
+                      'boards they match')
+  parser.add_argument('--records', metavar='FILE',
+                      help='append every game played to this binary game '
+                      'record file (see gamerecord.py)')
+  parser.add_argument('--sprt', action='store_true',
+                      help='stop each config once a sequential probability '
+                      'ratio test decides between e1 and e2')
+  parser.add_argument('--p0', type=float, default=0.5,
+                      help='share of decisive games e1 wins if not stronger')
+  parser.add_argument('--p1', type=float, default=0.65,
+                      help='share of decisive games e1 wins if stronger')
+  parser.add_argument('--alpha', type=float, default=0.05)
+  parser.add_argument('--beta', type=float, default=0.05)
+  parser.add_argument('--pairs', type=int, default=50,
+                      help='game pairs per config at most in SPRT mode')
+  args = parser.parse_args()
+  if args.sprt:
+    main_sprt(workers=args.workers, checkpoint=args.checkpoint,
+              solved=args.solved, records=args.records, p0=args.p0,
+              p1=args.p1, alpha=args.alpha, beta=args.beta, pairs=args.pairs)
+  else:
+    main(workers=args.workers, checkpoint=args.checkpoint, solved=args.solved,
+         records=args.records)
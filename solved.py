@@ -0,0 +1,153 @@
+# Solved-position database for small boards.
+#
+# solve works out the value under perfect play and the best move of every
+# position reachable from the empty board of an (n, s, blocks)
+# configuration, and write stores them one byte per position. Positions are
+# indexed in base 3 over the free cells (0 empty, 1 X, 2 O; the first free
+# cell in row-major order is the least significant digit). SolvedTable
+# memory-maps such a file read-only: concurrent game processes share the
+# page-cached file and a lookup reads a single byte in place.
+#
+#   python solved.py -n 4 -s 3 -b 0,0 0,3 3,0 3,3 -o corners.solved
+
+import mmap
+import struct
+import argparse
+
+from bitboard import Board, WIN, bits
+
+MAGIC = b'LMUP'
+VERSION = 1
+# Magic, version, n, s and the blocks as a mask of i * n + j bits
+HEADER = struct.Struct('<4sHBBQ')
+# An entry holds the value in its low two bits and the best move (the
+# number of the free cell) above them; 0 is a position never reached
+UNKNOWN = 0
+XWIN = 1
+OWIN = 2
+DRAW = 3
+NO_MOVE = 63
+VALUES = {XWIN: -WIN, OWIN: WIN, DRAW: 0}
+# 3 ** 16 entries is a 43MB file
+MAX_FREE = 16
+
+
+def _rank(value, plies, player):
+  # Preference of player for a child: quick wins, then draws, then slow
+  # losses
+  if value == DRAW:
+    return (1, 0)
+  if (value == XWIN) == (player == 'X'):
+    return (2, -plies)
+  return (0, plies)
+
+
+def solve(n, s, blocks=()):
+  # The entry of every position reachable from the empty board, as a
+  # bytearray indexed like the file
+  board = Board(n, s, blocks)
+  cells = list(bits(board.free))
+  if len(cells) > MAX_FREE:
+    raise ValueError(f'{len(cells)} free cells, at most {MAX_FREE} can be solved')
+  powers = [3**k for k in range(0, len(cells))]
+  table = bytearray(3**len(cells))
+  # Plies to the end of the game under best play
+  plies = bytearray(len(table))
+
+  def search(index, player):
+    result = board.result()
+    if result is not None:
+      value = XWIN if result == 'X' else OWIN if result == 'O' else DRAW
+      table[index] = value | NO_MOVE << 2
+      return
+    (other, digit) = ('O', 1) if player == 'X' else ('X', 2)
+    best = None
+    for k, idx in enumerate(cells):
+      if not board.free >> idx & 1:
+        continue
+      child = index + digit * powers[k]
+      if not table[child]:
+        board.play(idx, player)
+        search(child, other)
+        board.undo(idx, player)
+      value = table[child] & 3
+      rank = _rank(value, plies[child], player)
+      if best is None or rank > best:
+        best = rank
+        table[index] = value | k << 2
+        plies[index] = plies[child] + 1
+
+  search(0, 'X')
+  return table
+
+
+def write(path, n, s, blocks, table):
+  mask = 0
+  for (i, j) in blocks:
+    mask |= 1 << (i * n + j)
+  with open(path, 'wb') as f:
+    f.write(HEADER.pack(MAGIC, VERSION, n, s, mask))
+    f.write(table)
+
+
+class SolvedTable:
+
+  def __init__(self, path):
+    self.path = path
+    with open(path, 'rb') as f:
+      self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    (magic, version, n, s, mask) = HEADER.unpack_from(self.map, 0)
+    if magic != MAGIC or version != VERSION:
+      raise ValueError(f'{path} is not a solved-position file')
+    self.n = n
+    self.s = s
+    self.blocks = [(i, j)
+                   for i in range(0, n)
+                   for j in range(0, n)
+                   if mask >> (i * n + j) & 1]
+    board = Board(n, s, self.blocks)
+    self.key = (n, s, board.blocks)
+    self.cells = list(bits(board.free))
+    self.powers = {idx: 3**k for k, idx in enumerate(self.cells)}
+
+  def matches(self, board):
+    return (board.n, board.s, board.blocks) == self.key
+
+  def lookup(self, board):
+    # (value, move) of a position of a matching board, the value scored like
+    # e1 (-WIN, 0 or WIN) and the move a cell index (None once the game is
+    # over); None for a position that is not in the table
+    powers = self.powers
+    index = 0
+    for idx in bits(board.x):
+      index += powers[idx]
+    for idx in bits(board.o):
+      index += 2 * powers[idx]
+    entry = self.map[HEADER.size + index]
+    if entry & 3 == UNKNOWN:
+      return None
+    move = entry >> 2
+    return (VALUES[entry & 3], None if move == NO_MOVE else self.cells[move])
+
+  def close(self):
+    self.map.close()
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description='solve every position of a small board')
+  parser.add_argument('-n', type=int, required=True)
+  parser.add_argument('-s', type=int, required=True)
+  parser.add_argument('-b', '--blocks', nargs='*', default=[],
+                      help='blocked cells as row,column')
+  parser.add_argument('-o', '--output', required=True)
+  args = parser.parse_args()
+  blocks = [tuple(int(c) for c in block.split(',')) for block in args.blocks]
+  table = solve(args.n, args.s, blocks)
+  write(args.output, args.n, args.s, blocks, table)
+  reached = sum(1 for entry in table if entry)
+  print(f'{reached} positions, root {VALUES[table[0] & 3]}')
+
+
+if __name__ == '__main__':
+  main()
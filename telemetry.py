@@ -0,0 +1,123 @@
+# Per-move search statistics.
+#
+# Engine.think turns the counters of every search into one record (a plain
+# dict) and the gameTrace text is formatted from those records. A Telemetry
+# object passed to Engine additionally writes each record as a JSON line and
+# can time where the search spends its time. Timing works by wrapping the
+# terminal check, the horizon evaluation and move generation for the
+# duration of a move, so a game without telemetry runs the search
+# unchanged. Move generation is timed in Board.candidates alone, which move
+# ordering calls too, so it is counted once whichever produces the moves.
+
+import json
+import time
+from collections import Counter
+
+
+class Telemetry:
+
+  def __init__(self, sink=None, timing=False):
+    self.sink = sink
+    self.timing = timing
+    self.times = Counter()
+
+  def _timed(self, key, fn):
+    times = self.times
+    clock = time.perf_counter
+
+    def timed(*args, **kwargs):
+      start = clock()
+      result = fn(*args, **kwargs)
+      times[key] += clock() - start
+      return result
+
+    return timed
+
+  def _generate(self, fn):
+    # Move generators are lazy, so time producing the whole list
+    return self._timed('movegen', lambda *args: list(fn(*args)))
+
+  def begin(self, game):
+    self.times = Counter()
+    if not self.timing:
+      return
+    game.is_end = self._timed('terminal', game.is_end)
+    game.horizon = self._timed('heuristic', game.horizon)
+    game.board.candidates = self._generate(game.board.candidates)
+
+  def end(self, game, record):
+    # record is None when the search failed; the wrappers are removed anyway
+    if self.timing:
+      del game.is_end
+      del game.horizon
+      del game.board.candidates
+      if record is None:
+        return
+      record['times'] = {
+          key: self.times[key] for key in ('terminal', 'heuristic', 'movegen')
+      }
+
+  def emit(self, record):
+    if self.sink is not None:
+      self.sink.write(json.dumps(record) + '\n')
+
+
+def format_move(record):
+  # The per-move block of a gameTrace file
+  lines = [
+      f'Player {record["player"]} under AI control plays: '
+      f'row:{record["row"]}, column:{record["column"]}\n\n',
+      f'i\t\tEvaluation time: {round(record["time"], 7)}s\n',
+      f'ii\tHeuristic evaluations: {record["evals"]}\n',
+      f'iii\tEvaluations by depth: {record["depth_evals"]}\n',
+      f'iv\tAverage evaluation depth: {record["avg_depth"]:.2f}\n',
+  ]
+  if record.get('deepening'):
+    lines.append(f'v\tDepth reached: {record["depth"]}\n')
+  if 'radius' in record:
+    lines.append(f'\tBranching: {record["branching"]:.2f} '
+                 f'(effective {record["effective_branching"]:.2f}, '
+                 f'radius {record["radius"]})\n')
+  if 'mcts' in record:
+    lines.append(f'\tPlayouts: {record["mcts"]["iterations"]} '
+                 f'({record["mcts"]["iterations_per_sec"]:.0f}/s), '
+                 f'tree nodes: {record["mcts"]["tree_nodes"]} '
+                 f'({record["mcts"]["tree_bytes"]} bytes)\n')
+  if 'allocated' in record:
+    lines.append(f'\tClock: {record["time"]:.2f}s used of '
+                 f'{record["allocated"]:.2f}s allocated '
+                 f'(limit {record["limit"]:.2f}s), '
+                 f'{record["clock"]:.2f}s left\n')
+  if 'ordering' in record:
+    lines.append(f'\tCutoffs: {record["ordering"]["cutoffs"]} '
+                 f'({record["ordering"]["first_cutoff_rate"]:.1%} '
+                 f'on the first move)\n')
+  return ''.join(lines)
+
+
+def format_summary(records, result):
+  # The end-of-game block of a gameTrace file
+  if result == '.':
+    lines = ['It\'s a tie.\n\n']
+  else:
+    lines = [f'The winner is {result}.\n\n']
+  if records:
+    depth_evals = Counter()
+    for record in records:
+      depth_evals.update(record['depth_evals'])
+    avg_time = sum(round(r['time'], 7) for r in records) / len(records)
+    avg_depth = sum(r['avg_depth'] for r in records) / len(records)
+    lines += [
+        f'6(b)i\tAverage evaluation time: {avg_time:.2f}s\n',
+        f'6(b)ii\tTotal heuristic evaluations: '
+        f'{sum(r["evals"] for r in records)}\n',
+        f'6(b)iii\tEvaluations by depth: {dict(depth_evals)}\n',
+        f'6(b)iv\tAverage evaluation depth: {avg_depth:.2f}\n',
+        f'6(b)vi Total moves: {len(records)}\n',
+    ]
+    clocked = [r for r in records if 'allocated' in r]
+    if clocked:
+      lines.append(f'\tClock: {sum(r["time"] for r in clocked):.2f}s used '
+                   f'of {sum(r["allocated"] for r in clocked):.2f}s '
+                   f'allocated\n')
+  return ''.join(lines)
@@ -0,0 +1,126 @@
+# Game clock and per-move time allocation.
+#
+# Each side has a total time (plus an increment per move) instead of a
+# fixed time per move. TimeManager hands every move a share of what is
+# left: next to nothing for a move with a single legal or forced reply, and
+# otherwise the time left over the moves still to play, scaled by how wide
+# the branching is compared to the game so far. Iterative deepening then
+# stops early once the best move has stayed the same for a few iterations
+# and goes on longer (up to the hard limit) when the score swings between
+# iterations. An iteration is only started when it should finish in time,
+# going by how much longer the iteration of the same parity two depths
+# back took than the one before it (alpha-beta grows unevenly between odd
+# and even depths).
+
+from engine import MATE
+
+
+class TimeManager:
+
+  def __init__(self,
+               total,
+               increment=0.0,
+               moves=20,
+               reserve=0.1,
+               minimum=0.02,
+               stable=2,
+               swing=3):
+    # moves: moves a side is expected to play at most; reserve: seconds
+    # never spent; minimum: seconds for a forced move; stable: iterations
+    # with the same best move that halve the target; swing: score change
+    # between iterations that extends it
+    self.remaining = {'X': total, 'O': total}
+    self.increment = increment
+    self.moves = moves
+    self.reserve = reserve
+    self.minimum = minimum
+    self.stable = stable
+    self.swing = swing
+    # Running mean of the number of moves to choose from
+    self.branching = None
+    self.target = 0.0
+    self.limit = 0.0
+    self.best = None
+    self.score = None
+    self.repeats = 0
+    self.extended = False
+    # End of the last iteration and the time each iteration of this move
+    # took
+    self.last = 0.0
+    self.times = []
+
+  def forced(self, engine, moves):
+    # A move with one legal reply, or one the threat stage decides
+    if len(moves) == 1:
+      return True
+    if not engine.board.threats:
+      # Tracked for the clock even when the search does not use threats
+      engine.board.track_threats()
+    (value, _, block) = engine.forced(engine.player_turn == 'O')
+    return value is not None or (block is not None and len(block) == 1)
+
+  def allocate(self, engine, algo=None):
+    # The search limits for the move of the side to move: a hard time limit
+    # the search cannot go past, and a depth of 1 for a forced move. MCTS
+    # can stop after any playout, so it is given the target itself.
+    board = engine.board
+    moves = list(board.candidates())
+    left = max(self.remaining[engine.player_turn] - self.reserve,
+               self.minimum)
+    self.best = None
+    self.score = None
+    self.repeats = 0
+    self.extended = False
+    self.last = 0.0
+    self.times = []
+    if self.forced(engine, moves):
+      self.target = self.limit = min(self.minimum, left)
+      return {'time': self.limit, 'depth': 1}
+    target = left / max(1, min(self.moves, (board.empty + 1) // 2))
+    target += self.increment
+    if self.branching:
+      target *= min(max(len(moves) / self.branching, 0.75), 1.5)
+      self.branching = 0.8 * self.branching + 0.2 * len(moves)
+    else:
+      self.branching = len(moves)
+    self.target = min(target, left)
+    self.limit = min(3 * self.target, left)
+    if algo == engine.MCTS:
+      return {'time': self.target}
+    return {'time': self.limit}
+
+  def iteration(self, engine, depth, best, elapsed):
+    # Engine.on_iteration: whether to stop after this iteration
+    (score, x, y) = best
+    if (x, y) == self.best:
+      self.repeats += 1
+    else:
+      self.repeats = 0
+    if (self.score is not None and not self.extended and
+        abs(score - self.score) >= self.swing):
+      # An unsettled score: allow up to twice the time
+      self.target = min(2 * self.target, self.limit)
+      self.extended = True
+    self.best = (x, y)
+    self.score = score
+    if abs(score) >= MATE:
+      return True
+    times = self.times
+    times.append(elapsed - self.last)
+    self.last = elapsed
+    target = self.target / 2 if self.repeats >= self.stable else self.target
+    if len(times) >= 3 and times[-3] > 0:
+      growth = times[-2] / times[-3]
+    elif len(times) >= 2 and times[-2] > 0:
+      growth = times[-1] / times[-2]
+    else:
+      growth = 2.0
+    return elapsed + times[-1] * max(growth, 1.5) >= target
+
+  def spend(self, player, record):
+    # Charge a finished move to player's clock and note the allocation in
+    # its move record
+    self.remaining[player] += self.increment - record['time']
+    record['allocated'] = self.target
+    record['limit'] = self.limit
+    record['clock'] = self.remaining[player]
@@ -0,0 +1,79 @@
+# Transposition table keyed by the Zobrist hash kept by bitboard.Board.
+#
+# The table is a fixed number of two-entry buckets. The first entry of a
+# bucket is depth-preferred (only replaced by a search at least as deep),
+# the second is always replaced, so deep results survive while recent
+# shallow ones still get cached.
+
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+# Rough size of one stored entry (tuple plus its five fields) in CPython
+ENTRY_BYTES = 160
+
+
+class TranspositionTable:
+
+  def __init__(self, entries=None, max_bytes=None):
+    if entries is None:
+      entries = (max_bytes or 1 << 24) // ENTRY_BYTES
+    buckets = 1
+    while buckets * 2 <= entries // 2:
+      buckets *= 2
+    self.mask = buckets - 1
+    self.slots = [None] * (2 * buckets)
+    # Point of view of the stored values, kept by the engine (see
+    # Engine.use_tt)
+    self.view = None
+    self.clear_stats()
+
+  def clear_stats(self):
+    self.hits = 0
+    self.misses = 0
+    self.collisions = 0
+    self.stores = 0
+
+  def clear(self):
+    self.slots = [None] * len(self.slots)
+    self.clear_stats()
+
+  def probe(self, key):
+    # Returns (value, depth, flag, move) or None
+    i = (key & self.mask) << 1
+    slots = self.slots
+    entry = slots[i]
+    if entry is not None:
+      if entry[0] == key:
+        self.hits += 1
+        return entry[1:]
+      other = slots[i + 1]
+      if other is not None and other[0] == key:
+        self.hits += 1
+        return other[1:]
+      self.collisions += 1
+    self.misses += 1
+    return None
+
+  def store(self, key, value, depth, flag, move):
+    i = (key & self.mask) << 1
+    slots = self.slots
+    entry = slots[i]
+    self.stores += 1
+    if entry is None or entry[0] == key or entry[2] <= depth:
+      if entry is not None and entry[0] != key:
+        slots[i + 1] = entry
+      slots[i] = (key, value, depth, flag, move)
+    else:
+      slots[i + 1] = (key, value, depth, flag, move)
+
+  def stats(self):
+    probes = self.hits + self.misses
+    return {
+        'hits': self.hits,
+        'misses': self.misses,
+        'collisions': self.collisions,
+        'stores': self.stores,
+        'hit_rate': self.hits / probes if probes else 0.0,
+        'entries': len(self.slots),
+    }